@@ -5,50 +5,177 @@
 Contents:
         create_validation: A wrapper around sklearn train_test_split.
         create_model: Makes a model.
+        set_cache: Caches the results of create_model on disk.
+        register_metric: Sets the prediction a metric is scored on.
         inplace_encoder: Label encodes all columns with dtype = 'O'.
         feature_importances: Prints most important features in a model.
 
 '''
+import copy
+import functools
+import hashlib
+import numbers
+import os
+import pickle
+import types
+from collections import OrderedDict
+
+import joblib
 import numpy as np
-from sklearn.model_selection import train_test_split, TimeSeriesSplit
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone, is_classifier
+from sklearn.model_selection import TimeSeriesSplit
 from sklearn.preprocessing import LabelEncoder
 
+# Where set_cache stores the results of create_model
+_CACHE = {'path': None, 'max_bytes': None}
 
-def create_holdout(X, y, split_size=.3):
-    '''A wrapper around train_test_split.
+# The prediction each metric is scored on, by metric name. Metrics which
+# are not listed are scored on the output of predict.
+_METRIC_PREDICTIONS = {'roc_auc_score': 'positive_proba',
+                       'average_precision_score': 'positive_proba',
+                       'brier_score_loss': 'positive_proba',
+                       'log_loss': 'predict_proba'}
+_PREDICTION_METHODS = {'predict': 'predict',
+                       'predict_proba': 'predict_proba',
+                       'positive_proba': 'predict_proba'}
+
+
+def create_holdout(X, y, split_size=.3, copy=True):
+    '''Split off the last rows as a holdout set.
+    The same split as an unshuffled ``train_test_split``.
 
     Args:
         X (pd.DataFrame): The dataframe to split.
         y (pd.Series): The labels to split.
         split_size (float): Size of testing set. Default is .3.
+        copy (bool): If False the parts are slices of X and y rather than
+            copies, so changing them in place changes X and y.
+            Default is True.
 
     Example:
         >>> from henchman.learning import create_holdout
         >>> X, X_ho, y, y_ho = create_holdout(X, y)
     '''
-    return train_test_split(X, y, shuffle=False, test_size=split_size)
+    train, test = _holdout_slices(len(X), split_size)
+    parts = [_rows(X, train), _rows(X, test), _rows(y, train), _rows(y, test)]
+    if copy:
+        parts = [part.copy() for part in parts]
+    return parts
+
+
+def _holdout_slices(n_rows, split_size):
+    # As in train_test_split, a float test size is rounded up
+    if isinstance(split_size, numbers.Integral):
+        n_test = split_size
+    else:
+        n_test = int(np.ceil(split_size * n_rows))
+    return slice(0, n_rows - n_test), slice(n_rows - n_test, n_rows)
+
+
+def _as_slice(index):
+    '''A slice equal to an array of consecutive increasing positions,
+    or the array itself if there is none.
+    '''
+    if len(index) > 0 and np.all(np.diff(index) == 1):
+        return slice(index[0], index[-1] + 1)
+    return index
+
+
+def _rows(data, index):
+    if isinstance(data, np.ndarray):
+        return data[index]
+    return data.iloc[index]
+
+
+def register_metric(metric, prediction):
+    '''Set the prediction which ``create_model`` scores a metric on.
+    Metrics are matched by name, or by their key when the metrics
+    are passed to ``create_model`` as a dict. A ``functools.partial``
+    of a metric is also matched by the name of the metric. Unregistered
+    metrics are scored on ``predict``.
+
+    Args:
+        metric: A metric, its name or its key in a dict of metrics.
+        prediction (str): One of 'predict', 'predict_proba' for the
+            probability of every class, or 'positive_proba' for
+            the probability of the second class.
+
+    Example:
+        >>> from henchman.learning import register_metric
+        >>> from sklearn.metrics import hinge_loss
+        >>> register_metric(hinge_loss, 'positive_proba')
+        >>> from functools import partial
+        >>> register_metric('hinge', 'positive_proba')
+        >>> create_model(X, y, model, {'hinge': partial(hinge_loss, labels=[0, 1])})
+    '''
+    assert prediction in _PREDICTION_METHODS, \
+        'prediction must be one of {}'.format(sorted(_PREDICTION_METHODS))
+    name = metric if isinstance(metric, str) else _metric_name(metric)
+    _METRIC_PREDICTIONS[name] = prediction
 
 
-def _fit_predict(X_train, X_test, y_train, y_test, model, metric):
-    model = model
+def _metric_name(metric):
+    # A partial is named after the metric it wraps
+    func = metric.func if isinstance(metric, functools.partial) else metric
+    return getattr(func, '__name__', type(func).__name__)
+
+
+def _metric_prediction(name, metric):
+    '''The prediction a metric is scored on. It is registered under the
+    metric's own name, the key it was passed with or the name of the
+    metric a partial wraps, looked up in that order.
+    '''
+    for key in (getattr(metric, '__name__', None), name, _metric_name(metric)):
+        if key in _METRIC_PREDICTIONS:
+            return _METRIC_PREDICTIONS[key]
+    return 'predict'
+
+
+def _metric_dict(metric):
+    '''An ordered dictionary of name to metric for one metric, a list or a dict.'''
+    if isinstance(metric, dict):
+        return OrderedDict(metric)
+    if isinstance(metric, (list, tuple)):
+        metrics = OrderedDict((_metric_name(m), m) for m in metric)
+        assert len(metrics) == len(metric), \
+            'Metrics share a name, pass a dict of metrics to name them'
+        return metrics
+    return OrderedDict([(_metric_name(metric), metric)])
+
+
+def _fit_predict(X_train, X_test, y_train, y_test, model, metrics):
     model.fit(X_train, y_train)
+    return _score_model(model, X_test, y_test, metrics), model
 
-    if metric.__name__ == 'roc_auc_score':
-        return metric(y_test, model.predict_proba(X_test)[:, 1]), model
 
-    preds = model.predict(X_test)
-    return metric(y_test, preds), model
+def _score_model(model, X_test, y_test, metrics):
+    # Each prediction method is called at most once, whatever the metrics
+    predictions = {}
+    scores = OrderedDict()
+    for name, metric in metrics.items():
+        prediction = _metric_prediction(name, metric)
+        method = _PREDICTION_METHODS[prediction]
+        if method not in predictions:
+            predictions[method] = getattr(model, method)(X_test)
+        preds = predictions[method]
+        if prediction == 'positive_proba':
+            preds = preds[:, 1]
+        scores[name] = metric(y_test, preds)
+    return scores
 
 
-def _score_tt(X, y, model, metric, split_size):
-    X_train, X_test, y_train, y_test = train_test_split(X, y, shuffle=False, test_size=split_size)
-    score, fit_model = _fit_predict(X_train, X_test,
-                                    y_train, y_test, model, metric)
-    return [score], fit_model
+def _score_fold(X, y, train_index, test_index, model, metrics):
+    # Slices of rows are views, so no fold is copied here
+    return _fit_predict(_rows(X, train_index), _rows(X, test_index),
+                        _rows(y, train_index), _rows(y, test_index), model, metrics)
 
 
 def create_model(X, y, model=None, metric=None,
-                 n_splits=1, split_size=.3, _return_df=False):
+                 n_splits=1, split_size=.3, _return_df=False,
+                 n_jobs=1, backend=None, return_models=False, as_array=False,
+                 incremental=False):
     '''Make a model. Returns a scorelist and a fit model.
     A wrapper around a standard scoring workflow. Uses
     ``train_test_split`` unless otherwise specified (in which case
@@ -62,15 +189,36 @@ def create_model(X, y, model=None, metric=None,
         X (pd.DataFrame): A cleaned numeric feature matrix.
         y (pd.Series): A column of labels.
         model: A sklearn model with fit and predict methods.
-        metric: A metric which takes y_test, preds and returns a score.
+        metric: A metric which takes y_test, preds and returns a score,
+                or a list or dict of them. All metrics are scored on the same
+                fit, calling ``predict`` and ``predict_proba`` at most once
+                per fold. See ``register_metric`` for which prediction a
+                metric is scored on.
         n_splits (int): If 1 use a train_test_split. Otherwise use tssplit.
                 Default value is 1.
         split_size (float): Size of testing set. Default is .3.
         _return_df (bool): If true, return (X_train, X_test, y_train, y_test) after returns.
                 Not generally useful, but sometimes necessary.
+        n_jobs (int): The number of folds to fit at once. If not 1, every fold
+                fits its own clone of ``model``. Default is 1.
+        backend (str): The joblib backend to fit folds with, for instance
+                'threading' for models which release the GIL. Default is joblib's.
+        return_models (bool): If true, return the fit model of every fold
+                instead of the last one.
+        as_array (bool): If true, convert X to one C contiguous float array
+                and y to an array, so every fold is a view which models use
+                without copying. The models are then fit without column names.
+        incremental (bool): If true and ``n_splits`` > 1, train one clone of
+                ``model`` through the folds, on the rows each fold adds to
+                the last one, and score it on every fold's test rows as it goes.
+                Needs a model with ``partial_fit`` or a sklearn ensemble with
+                ``warm_start``, which grows by its ``n_estimators`` (or ``max_iter``
+                for histogram gradient boosting) every fold.
 
     Returns:
         (list[float], sklearn.ensemble): A list of scores and a fit model.
+                If ``metric`` is a list or dict, the scores are a dict of
+                metric name (or key) to a list of scores.
 
     Example:
         >>> from henchman.learning import create_model
@@ -82,29 +230,226 @@ def create_model(X, y, model=None, metric=None,
         ...                                  roc_auc_score,
         ...                                  n_splits=5)
         >>> print('Average score of {:.2f}'.format(np.mean(scores)))
+        >>> from sklearn.metrics import accuracy_score, log_loss
+        >>> scores, fit_model = create_model(X, y,
+        ...                                  RandomForestClassifier(),
+        ...                                  [roc_auc_score, log_loss, accuracy_score])
+        >>> scores['log_loss']
 
     '''
     assert np.array_equal(X.index, y.index)
     assert model is not None
     assert metric is not None
+    metrics = _metric_dict(metric)
+    key, result = None, None
+    if _CACHE['path'] is not None:
+        key = _cache_key(X, y, model, metrics, n_splits, split_size, return_models, as_array,
+                         incremental)
+    if key is not None:
+        result = _cache_load(key)
+    if result is None:
+        result = _score_splits(X, y, model, metrics, n_splits, split_size,
+                               n_jobs, backend, return_models, as_array, incremental)
+        if key is not None:
+            _cache_store(key, result)
+    scores, fit_model = result
+    if not isinstance(metric, (list, tuple, dict)):
+        result = scores[next(iter(scores))], fit_model
+    if _return_df:
+        train_index, test_index = _splits(X, n_splits, split_size)[-1]
+        return result, (_rows(X, train_index), _rows(X, test_index),
+                        _rows(y, train_index), _rows(y, test_index))
+    return result
+
+
+def _splits(X, n_splits, split_size):
     if n_splits == 1:
-        if _return_df:
-            return _score_tt(X, y, model, metric, split_size), create_holdout(X, y, split_size)
-        return _score_tt(X, y, model, metric, split_size)
-
-    if n_splits > 1:
-        scorelist = []
-        tssplit = TimeSeriesSplit(n_splits=n_splits)
-        for i, (train_index, test_index) in enumerate(tssplit.split(X)):
-            X_train, X_test = X.iloc[train_index], X.iloc[test_index]
-            y_train, y_test = y.iloc[train_index], y.iloc[test_index]
-
-            score, fit_model = _fit_predict(X_train, X_test,
-                                            y_train, y_test, model, metric)
-            scorelist.append(score)
-        if _return_df:
-            return (scorelist, fit_model), (X_train, X_test, y_train, y_test)
-        return scorelist, fit_model
+        return [_holdout_slices(len(X), split_size)]
+    # Time series folds are ranges of rows, so they are taken as slices
+    return [(_as_slice(train_index), _as_slice(test_index))
+            for train_index, test_index in TimeSeriesSplit(n_splits=n_splits).split(X)]
+
+
+def _score_splits(X, y, model, metrics, n_splits, split_size,
+                  n_jobs, backend, return_models, as_array, incremental=False):
+    splits = _splits(X, n_splits, split_size)
+    if as_array:
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        y = np.asarray(y)
+    if incremental and len(splits) > 1:
+        return _score_incremental(X, y, model, metrics, splits, return_models)
+    if n_jobs == 1 or len(splits) == 1:
+        results = [_score_fold(X, y, train_index, test_index,
+                               clone(model) if return_models else model, metrics)
+                   for train_index, test_index in splits]
+    else:
+        # Every fold fits its own copy of the model
+        results = Parallel(n_jobs=n_jobs, backend=backend)(
+            delayed(_score_fold)(X, y, train_index, test_index, clone(model), metrics)
+            for train_index, test_index in splits)
+    fit_model = [fit for _, fit in results] if return_models else results[-1][1]
+    return _scores_by_metric([score for score, _ in results], metrics), fit_model
+
+
+def _scores_by_metric(fold_scores, metrics):
+    '''Turn a list of scores by metric for every fold into lists of scores by metric.'''
+    return OrderedDict((name, [scores[name] for scores in fold_scores]) for name in metrics)
+
+
+def _ensemble_size_param(model):
+    '''The parameter a warm started ensemble grows by, or None if it is not one.'''
+    params = model.get_params()
+    if 'warm_start' not in params or not type(model).__module__.startswith('sklearn.ensemble'):
+        return None
+    for name in ('n_estimators', 'max_iter'):
+        if name in params:
+            return name
+    return None
+
+
+def _score_incremental(X, y, model, metrics, splits, return_models):
+    model = clone(model)
+    size_param = None
+    if not hasattr(model, 'partial_fit'):
+        # Other warm started models would only be refit on the newest rows
+        size_param = _ensemble_size_param(model)
+        assert size_param is not None, \
+            'incremental needs a model with partial_fit or a warm_start ensemble'
+        model.set_params(warm_start=True)
+    step = model.get_params()[size_param] if size_param is not None else None
+    classes = np.unique(y) if is_classifier(model) else None
+
+    fold_scores, models = [], []
+    start = 0
+    for i, (train_index, test_index) in enumerate(splits):
+        # Expanding windows, so the rows new to this fold follow the last fold's
+        new_rows = slice(start, train_index.stop)
+        X_new, y_new = _rows(X, new_rows), _rows(y, new_rows)
+        if hasattr(model, 'partial_fit'):
+            if classes is not None:
+                model.partial_fit(X_new, y_new, classes=classes)
+            else:
+                model.partial_fit(X_new, y_new)
+        else:
+            if i > 0:
+                model.set_params(**{size_param: getattr(model, size_param) + step})
+            model.fit(X_new, y_new)
+        start = train_index.stop
+        fold_scores.append(_score_model(model, _rows(X, test_index), _rows(y, test_index),
+                                        metrics))
+        if return_models:
+            models.append(copy.deepcopy(model))
+    return _scores_by_metric(fold_scores, metrics), models if return_models else model
+
+
+def set_cache(path=None, max_bytes=2 ** 30):
+    '''Cache the scores and fit models of ``create_model`` on disk.
+    Results are keyed on a hash of the contents of X and y, the class and
+    ``get_params()`` of the model, the metric and the split settings, so
+    calling ``create_model`` again with the same arguments, for instance
+    through ``Dendrogram.score_at_point`` or the plotting functions, loads
+    the results instead of fitting again. A cache hit returns the cached
+    fit model and leaves ``model`` unfit. Once the cache holds more than
+    ``max_bytes``, the least recently used results are removed.
+
+    Metrics are keyed on their code, defaults and closure, so redefining
+    a metric or passing a different lambda is a cache miss. Metrics which
+    cannot be hashed are not cached. The setting is not visible inside
+    joblib worker processes, so ``Dendrogram.score_path``, ``RandomSelect``
+    and ``SequentialSelect`` do not use the cache when ``n_jobs`` is not 1.
+
+    Args:
+        path (str): The directory to cache in. Created if it does not exist.
+            If None, turn the cache off. Default is None.
+        max_bytes (int): The largest size of the cache. Default is 1GB.
+
+    Example:
+        >>> from henchman.learning import set_cache
+        >>> set_cache('.henchman_cache')
+    '''
+    if path is not None and not os.path.isdir(path):
+        os.makedirs(path)
+    _CACHE['path'] = path
+    _CACHE['max_bytes'] = max_bytes
+
+
+def _cache_key(X, y, model, metrics, n_splits, split_size, return_models, as_array,
+               incremental):
+    digest = hashlib.sha1()
+    for data in (X, y):
+        digest.update(pd.util.hash_pandas_object(data).values.tobytes())
+    digest.update(repr([(col, str(dtype)) for col, dtype in X.dtypes.items()]).encode())
+    try:
+        metric_keys = [(name, _metric_key(metric), _metric_prediction(name, metric))
+                       for name, metric in metrics.items()]
+        # repr shortens large arrays, so array valued parameters are hashed
+        model_key = joblib.hash(model.get_params())
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+    digest.update(repr((type(model).__module__, type(model).__name__,
+                        model_key, metric_keys, n_splits, split_size,
+                        return_models, as_array, incremental)).encode())
+    return digest.hexdigest()
+
+
+def _metric_key(metric):
+    '''A hash of what a metric computes, so that lambdas and redefined
+    functions with the same name are told apart.
+    '''
+    code = getattr(metric, '__code__', None)
+    if code is None:
+        # For instance a functools.partial or a callable object
+        return joblib.hash(metric)
+    cells = [cell.cell_contents for cell in metric.__closure__ or ()]
+    return joblib.hash((metric.__module__, metric.__name__, _code_key(code),
+                        metric.__defaults__, cells))
+
+
+def _code_key(code):
+    # Leaves out the file name and line numbers, which change between notebook runs
+    consts = tuple(_code_key(const) if isinstance(const, types.CodeType) else const
+                   for const in code.co_consts)
+    return code.co_code, consts, code.co_names, code.co_varnames
+
+
+def _cache_load(key):
+    filename = os.path.join(_CACHE['path'], key + '.pkl')
+    try:
+        # The modification time orders results by their last use
+        os.utime(filename, None)
+        return joblib.load(filename)
+    except (IOError, OSError):
+        # Not cached, or removed by another process
+        return None
+
+
+def _cache_store(key, result):
+    path = _CACHE['path']
+    filename = os.path.join(path, key + '.pkl')
+    # Write to a temporary file first so a partial result is never read
+    temp = '{}.{}.tmp'.format(filename, os.getpid())
+    joblib.dump(result, temp)
+    getattr(os, 'replace', os.rename)(temp, filename)
+
+    # Another process may remove any of these files while we look at them
+    entries = []
+    for name in os.listdir(path):
+        if name.endswith('.pkl'):
+            entry = os.path.join(path, name)
+            try:
+                entries.append((os.path.getmtime(entry), os.path.getsize(entry), entry))
+            except OSError:
+                pass
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in entries[:-1]:
+        if total <= _CACHE['max_bytes']:
+            break
+        total -= size
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
 
 
 def inplace_encoder(X):
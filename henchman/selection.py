@@ -4,32 +4,80 @@
 
 Contents:
         RandomSelect (X, n_feats): Choose n_feats at random
+        SequentialSelect (n_feats, model, metric): Add or remove features greedily
         Dendrogram (X, pairing_func, max_threshes)
+        CorrelationAccumulator ()
+        register_matrix_pairing (pairing_func, matrix_func)
+        set_fit_cache (max_bytes)
 '''
+import hashlib
+import json
+import os
+import sys
 import numpy as np
 import pandas as pd
-import math
 import random
 
-from tqdm import tqdm
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from itertools import count, islice
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from joblib import Parallel, delayed, cpu_count
+from sklearn.base import clone
 
 from henchman.learning import create_model
 
+# Fitted Dendrogram structures kept for reuse by Dendrogram.fit. See set_fit_cache
+_FIT_CACHE = {'max_bytes': None, 'fits': OrderedDict(), 'nbytes': 0}
+
 
 class RandomSelect:
     """Randomly choose a feature set.
     """
 
-    def __init__(self, names=None, n_feats=0):
+    def __init__(self, names=None, n_feats=0, model=None, metric=None,
+                 n_subsets=100, n_splits=1, min_fraction=.1, eta=3,
+                 greater_is_better=True, n_jobs=1, random_state=None):
         '''A class for randomly choosing a feature set.
+        If given a model and a metric, ``fit`` searches many random feature
+        sets instead and keeps the best. Every set is scored on the first
+        ``min_fraction`` of the rows and the best ``1 / eta`` of them are
+        scored again on ``eta`` times as many rows, until the survivors are
+        scored on all of the rows (successive halving).
 
         Args:
             names (list[str]): A list of column names selected. Default is the empty list.
             n_feats (int): The number of features to randomly select.
+            model: A sklearn model with fit and predict methods. If given with
+                ``metric``, search for the best random feature set.
+            metric: A metric which takes y_test, preds and returns a score.
+            n_subsets (int): The number of random feature sets to search.
+                Default is 100.
+            n_splits (int): If 1 use a train_test_split. Otherwise use tssplit.
+                Default value is 1.
+            min_fraction (float): The fraction of rows every feature set is
+                first scored on. Default is .1. A round is never scored on
+                fewer than 20 rows for every fold and its test rows. Feature
+                sets which cannot be scored on a round's rows, for instance
+                because a fold has one class, are ranked last.
+            eta (int): The factor by which the number of feature sets shrinks
+                and the number of rows grows between rounds. Default is 3.
+            greater_is_better (bool): Whether a higher score is better.
+                Default is True.
+            n_jobs (int): The number of processes to score with. Default is 1.
+            random_state (int): Seed for drawing the feature sets.
         '''
         self.names = []
         self.n_feats = n_feats
+        self.model = model
+        self.metric = metric
+        self.n_subsets = n_subsets
+        self.n_splits = n_splits
+        self.min_fraction = min_fraction
+        self.eta = eta
+        self.greater_is_better = greater_is_better
+        self.n_jobs = n_jobs
+        self.random_state = random_state
 
     def set_params(self, **params):
         '''Method to functionally assign parameters.
@@ -39,19 +87,68 @@ class RandomSelect:
             setattr(self, key, params[key])
         return self
 
-    def fit(self, X, x=None):
+    def fit(self, X, y=None):
         '''Randomly choose which features to select.
+        If the selector has a model and a metric, search for the
+        best of ``n_subsets`` random feature sets. The score of every
+        evaluated set is kept in ``self.search_scores``.
+
         Args:
             X (pd.Dataframe): A dataframe from which to select
                 a subset of columns.
+            y (pd.Series): Labels for X. Needed for a search.
+
+        Example:
+            >>> from henchman.selection import RandomSelect
+            >>> sel = RandomSelect(n_feats=20, model=RandomForestClassifier(),
+            ...                    metric=roc_auc_score, n_subsets=300, n_jobs=-1)
+            >>> sel.fit(X, y)
+            >>> sel.transform(X).head()
         '''
         X = pd.DataFrame(X)
+        if self.model is not None and self.metric is not None:
+            return self._search(X, y)
         column_list = [i for i in range(0, len(X.columns))]
 
         random.shuffle(column_list)
         column_list = column_list[:self.n_feats]
         all_columns = X.columns.values
         self.names = [all_columns[item] for item in column_list]
+        return self
+
+    def _search(self, X, y):
+        assert y is not None, 'A search needs labels y'
+        rng = np.random.RandomState(self.random_state)
+        all_columns = X.columns.values
+        candidates = [list(all_columns[np.sort(rng.choice(len(all_columns), self.n_feats,
+                                                          replace=False))])
+                      for _ in range(self.n_subsets)]
+        sign = 1 if self.greater_is_better else -1
+        fraction = self.min_fraction
+        rows = []
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            for rung in count():
+                n_rows = int(np.ceil(len(X) * min(fraction, 1)))
+                n_rows = min(max(n_rows, (self.n_splits + 1) * _MIN_FOLD_ROWS), len(X))
+                X_rung, y_rung = X.iloc[:n_rows], y.iloc[:n_rows]
+                scores = parallel(delayed(_try_score_features)(X_rung, y_rung,
+                                                               clone(self.model), self.metric,
+                                                               names, self.n_splits)
+                                  for names in candidates)
+                scores = np.array(scores, dtype=float)
+                rows.extend((rung, n_rows, names, score)
+                            for names, score in zip(candidates, scores))
+                # Keep the best candidates for a round on more rows
+                order = np.argsort(-sign * scores, kind='mergesort')
+                if n_rows == len(X) or len(candidates) == 1:
+                    break
+                candidates = [candidates[i]
+                              for i in order[:max(len(candidates) // self.eta, 1)]]
+                fraction *= self.eta
+        assert not np.isnan(scores[order[0]]), 'No feature set could be scored'
+        self.names = candidates[order[0]]
+        self.search_scores = pd.DataFrame(rows, columns=['rung', 'n_rows', 'names', 'score'])
+        return self
 
     def transform(self, X):
         '''Returns a subset of a dataframe.
@@ -66,13 +163,171 @@ class RandomSelect:
         return X[self.names]
 
 
+class SequentialSelect:
+    """Greedily add or remove features.
+    """
+
+    def __init__(self, n_feats=10, model=None, metric=None, direction='forward',
+                 n_splits=1, drop_fraction=0., dendrogram=None, pool_size=None,
+                 greater_is_better=True, n_jobs=1):
+        '''A class for choosing a feature set one feature at a time.
+        Going forward, every round scores the selected features together with
+        each remaining feature and adds the best one. Going backward, every
+        round scores the selected features without each one and removes the
+        feature whose removal scores best. The candidates of a round are
+        scored in parallel.
+
+        Args:
+            n_feats (int): The number of features to select. Default is 10.
+            model: A sklearn model with fit and predict methods.
+            metric: A metric which takes y_test, preds and returns a score.
+            direction (str): Either 'forward' or 'backward'. Default is 'forward'.
+            n_splits (int): If 1 use a train_test_split. Otherwise use tssplit.
+                Default value is 1.
+            drop_fraction (float): The fraction of the worst candidates which
+                are dropped early every round. Going forward they are never
+                tried again, going backward they are removed together with
+                the round's feature. Default is 0.
+            dendrogram (Dendrogram): If given with ``pool_size``, start from
+                one representative of each of the components of its set of
+                ``pool_size`` features instead of from every column.
+            pool_size (int): The number of Dendrogram components to start from.
+            greater_is_better (bool): Whether a higher score is better.
+                Default is True.
+            n_jobs (int): The number of processes to score with. Default is 1.
+        '''
+        self.n_feats = n_feats
+        self.model = model
+        self.metric = metric
+        self.direction = direction
+        self.n_splits = n_splits
+        self.drop_fraction = drop_fraction
+        self.dendrogram = dendrogram
+        self.pool_size = pool_size
+        self.greater_is_better = greater_is_better
+        self.n_jobs = n_jobs
+        self.names = []
+
+    def set_params(self, **params):
+        '''Method to functionally assign parameters.
+        Expects a dictionary ``**params`` as input.
+        '''
+        for key in params:
+            setattr(self, key, params[key])
+        return self
+
+    def get_params(self, deep=True):
+        '''Get the parameters of the selector.
+
+        Args:
+            deep (bool): Ignored.
+
+        Returns:
+            A dictionary of parameter names and values. (dict)
+        '''
+        return {name: getattr(self, name)
+                for name in ('n_feats', 'model', 'metric', 'direction', 'n_splits',
+                             'drop_fraction', 'dendrogram', 'pool_size',
+                             'greater_is_better', 'n_jobs')}
+
+    def fit(self, X, y):
+        '''Select features one at a time.
+        The feature and score of every round are kept in ``self.path``.
+
+        Args:
+            X (pd.DataFrame): A dataframe from which to select
+                a subset of columns.
+            y (pd.Series): Labels for X.
+
+        Example:
+            >>> from henchman.selection import SequentialSelect
+            >>> sel = SequentialSelect(n_feats=10, model=RandomForestClassifier(),
+            ...                        metric=roc_auc_score, n_jobs=-1)
+            >>> sel.fit(X, y)
+            >>> sel.transform(X).head()
+        '''
+        assert self.direction in ('forward', 'backward')
+        assert self.model is not None and self.metric is not None
+        if self.dendrogram is not None and self.pool_size is not None:
+            pool = self.dendrogram.features_at_step(
+                self.dendrogram.find_set_of_size(self.pool_size))
+        else:
+            pool = list(X.columns)
+        sign = 1 if self.greater_is_better else -1
+        forward = self.direction == 'forward'
+        selected = [] if forward else list(pool)
+        remaining = list(pool) if forward else []
+        rows = []
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            while True:
+                if forward:
+                    if len(selected) >= self.n_feats or not remaining:
+                        break
+                    candidates = remaining
+                    featuresets = [selected + [feature] for feature in candidates]
+                else:
+                    if len(selected) <= self.n_feats:
+                        break
+                    candidates = selected
+                    featuresets = [[other for other in selected if other != feature]
+                                   for feature in candidates]
+                scores = parallel(delayed(_score_features)(X, y, clone(self.model),
+                                                           self.metric, features,
+                                                           self.n_splits)
+                                  for features in featuresets)
+                scores = np.array([np.mean(scorelist) for scorelist in scores])
+                order = np.argsort(-sign * scores, kind='mergesort')
+                best = candidates[order[0]]
+                # The candidates which scored worst are dropped early
+                n_drop = int(self.drop_fraction * len(candidates))
+                if forward:
+                    dropped = [candidates[i] for i in order[max(len(order) - n_drop, 1):]]
+                    selected.append(best)
+                    remaining = [feature for feature in remaining
+                                 if feature != best and feature not in dropped]
+                else:
+                    # Removing these features scored best after removing best
+                    n_drop = min(n_drop, len(selected) - self.n_feats - 1)
+                    dropped = [candidates[i] for i in order[1:n_drop + 1]]
+                    selected = [feature for feature in selected
+                                if feature != best and feature not in dropped]
+                rows.append((len(selected), best, scores[order[0]]))
+        self.names = selected
+        self.path = pd.DataFrame(rows, columns=['n_features', 'feature', 'score'])
+        return self
+
+    def transform(self, X):
+        '''Returns a subset of a dataframe.
+
+        Args:
+            X (pd.DataFrame): A dataframe with the same
+                column names as the one with which the selector
+                was fit.
+        Returns:
+            X_trans (pd.DataFrame): The dataframe subset X[self.names].
+        '''
+        X = pd.DataFrame(X)
+        return X[self.names]
+
+
 class Dendrogram():
     """ Pair features by an arbitrary function.
         Creates a dendrogram which is a set of graphs
         representing connectivity at a set of discrete thresholds.
     """
 
-    def __init__(self, X=None, pairing_func=None, max_threshes=None):
+    # Parameters which are set by __init__ and returned by get_params
+    _param_names = ('pairing_func', 'max_threshes', 'symmetric', 'n_jobs', 'method',
+                    'approximate', 'approx_thresh', 'n_bands', 'band_bits',
+                    'random_state', 'tile_size', 'dtype', 'mmap_path', 'lazy',
+                    'cache_size', 'n_feats', 'sizes')
+
+    def __init__(self, X=None, pairing_func=None, max_threshes=None,
+                 symmetric=False, n_jobs=1, method='thresholds',
+                 approximate=False, approx_thresh=.3, n_bands=None,
+                 band_bits=None, random_state=None, tile_size=None,
+                 dtype=np.float64, mmap_path=None, lazy=False, cache_size=16,
+                 n_feats=10, sizes=None):
         '''An object to store graphs for a given pairing function.
         If given a dataframe X this first creates an
         adjacency matrix given a certain pairing function.
@@ -83,36 +338,359 @@ class Dendrogram():
         Args:
             X (pd.DataFrame): The dataframe for which to build the Dendrogram.
             pairing_func (func): A function which takes in two columns and
-                returns a number.
+                returns a number, or the name of a built in pairing: 'correlation'
+                (the default), 'pairwise_correlation', which correlates every
+                pair over the rows where both are present so that missing
+                values do not drop columns, or 'cramers_v' and 'mutual_info'
+                for categorical and mixed data. These factorize every column,
+                cutting numeric columns with many values into 10 quantiles.
             max_threshes (int): The maximum number of graphs to build.
+            symmetric (bool): If True assume ``pairing_func`` is symmetric and
+                only evaluate it on the upper triangle. Default is False.
+            n_jobs (int): The number of processes used to evaluate
+                ``pairing_func``. Default is 1.
+            method (str): Either 'thresholds', which builds a graph at every
+                (sampled) unique value of the adjacency graph, or 'merge_tree',
+                which records the exact single-linkage merge sequence so that
+                every number of components is a step. Default is 'thresholds'.
+            approximate (bool): If True do not build the adjacency graph.
+                Instead find the pairs of highly correlated columns with
+                random projection hashing and keep only the edges whose
+                weight is at most ``approx_thresh``. Only available for
+                the default pairing. Default is False.
+            approx_thresh (float): The largest edge weight kept when
+                ``approximate`` is True. Default is .3.
+            n_bands (int): The number of random projection hashes per column
+                when ``approximate`` is True. More bands miss fewer edges.
+                By default enough to find an edge of weight ``approx_thresh``
+                nine times in ten, and at most 100.
+            band_bits (int): The number of projections per hash when
+                ``approximate`` is True. More bits give fewer candidate pairs.
+                Default is one more than log2 of the number of columns.
+            random_state (int): Seed for the random projections.
+            tile_size (int): Compute the adjacency graph in tiles of this many
+                columns. See ``adj_maker``.
+            dtype (np.dtype): The dtype of the adjacency graph. Default is float64.
+            mmap_path (str): If given, store the adjacency graph in a
+                ``np.memmap`` at this path. Edges and graphs are then built
+                from a minimum spanning forest read one row at a time, so the
+                adjacency graph is never loaded into memory and ``edges``
+                holds only the forest's edges.
+            lazy (bool): If True only the sorted edges and the merges between
+                components are found when fitting. The components at a step
+                are computed when the step is first used. Steps of the
+                'merge_tree' method are always computed this way.
+                Default is False.
+            cache_size (int): The number of steps whose components are kept
+                in memory when they are computed lazily. Default is 16.
+            n_feats (int): The number of columns ``transform`` returns.
+                Default is 10.
+            sizes (list[int]): If given, build graphs only at the thresholds
+                where the number of components first drops to each of these
+                sizes, instead of at the unique values of the adjacency graph.
+                ``max_threshes`` is then ignored. Only used by the 'thresholds'
+                method.
 
         '''
+        self.pairing_func = pairing_func
+        self.max_threshes = max_threshes
+        self.symmetric = symmetric
+        self.n_jobs = n_jobs
+        self.method = method
+        self.approximate = approximate
+        self.approx_thresh = approx_thresh
+        self.n_bands = n_bands
+        self.band_bits = band_bits
+        self.random_state = random_state
+        self.tile_size = tile_size
+        self.dtype = dtype
+        self.mmap_path = mmap_path
+        self.lazy = lazy
+        self.cache_size = cache_size
+        self.n_feats = n_feats
+        self.sizes = sizes
         if X is not None:
-            self.fit(X, pairing_func=pairing_func, max_threshes=max_threshes)
+            self.fit(X)
 
-    def fit(self, X, pairing_func=None, max_threshes=None):
+    def fit(self, X, y=None, **params):
         '''Build graphs for a given pairing function.
         First creates an adjacency matrix given a certain pairing function.
         It will then go through and build endges and graphs from those
         edge-vertex pairs. The graphs are all stored in order.
 
+        If turned on with ``set_fit_cache``, the fitted graphs are kept,
+        keyed on a hash of ``X`` and the parameters which change the graphs.
+        Fitting the same data again, for instance while ``n_feats`` is tuned
+        in a ``GridSearchCV``, reuses them. Fits with an ``mmap_path`` are
+        not kept.
+
         Args:
             X (pd.DataFrame): The dataframe for which to build the Dendrogram.
-            pairing_func (func): A function which takes in two columns and
-                returns a number.
-            max_threshes (int): The maximum number of graphs to build.
+            y: Ignored. A pairing function must be given as ``pairing_func``.
+            **params: Parameters of the Dendrogram to set before fitting.
+                See ``Dendrogram``.
+
+        Returns:
+            The fitted Dendrogram. (Dendrogram)
+
+        Example:
+            >>> from sklearn.model_selection import GridSearchCV
+            >>> from sklearn.pipeline import Pipeline
+            >>> set_fit_cache(2 ** 28)
+            >>> pipe = Pipeline([('dend', Dendrogram()),
+            ...                  ('model', RandomForestClassifier())])
+            >>> search = GridSearchCV(pipe, {'dend__n_feats': [10, 20, 40]})
+            >>> search.fit(X, y)
         '''
+        assert not callable(y), \
+            'fit(X, pairing_func) is no longer supported, use fit(X, pairing_func=pairing_func)'
+        X = pd.DataFrame(X)
+        self.set_params(**params)
+        if _FIT_CACHE['max_bytes'] is None or self.mmap_path is not None:
+            return self._fit(X)
+
+        params = self.get_params()
+        params['dtype'] = np.dtype(self.dtype).str
+        if self.sizes is not None:
+            params['sizes'] = tuple(self.sizes)
+        key = (_fingerprint(X),) + tuple(value for name, value in sorted(params.items())
+                                         if name not in ('n_jobs', 'n_feats'))
+        fits = _FIT_CACHE['fits']
+        if key in fits:
+            # The most recently used fit goes last
+            state, nbytes = fits.pop(key)
+            fits[key] = state, nbytes
+        else:
+            self._fit(X)
+            state = {name: value for name, value in vars(self).items()
+                     if name not in self._param_names}
+            nbytes = _nbytes(state)
+            if nbytes > _FIT_CACHE['max_bytes']:
+                return self
+            while fits and _FIT_CACHE['nbytes'] + nbytes > _FIT_CACHE['max_bytes']:
+                _FIT_CACHE['nbytes'] -= fits.popitem(last=False)[1][1]
+            fits[key] = state, nbytes
+            _FIT_CACHE['nbytes'] += nbytes
+        self.__dict__.update(state)
+        # add_columns changes columns in place
+        self.columns = dict(state['columns'])
+        return self
+
+    def _fit(self, X):
+        assert self.method in ('thresholds', 'merge_tree')
+        X = pd.DataFrame(X)
+        pairing_func = _NAMED_PAIRINGS.get(self.pairing_func, self.pairing_func)
         if pairing_func is None:
             pairing_func = _one_minus_corr
+        self._pairing_func = pairing_func
+        # The built in pairings are all symmetric
+        self._symmetric = self.symmetric or _pairing_name(pairing_func) is not None
+        self._approx_thresh = self.approx_thresh if self.approximate else None
+
+        if self.approximate:
+            assert pairing_func is _one_minus_corr, \
+                'approximate is only available for the default pairing_func'
+            # Only keep a sparse set of edges
+            self.adj = None
+            self.columns = {i: col for i, col in enumerate(X)}
+            self._edge_array, self._edge_weights = _approximate_edge_index(
+                X, self.approx_thresh, n_bands=self.n_bands,
+                band_bits=self.band_bits, random_state=self.random_state)
+        else:
+            # Create adjacency matrix and columns list
+            self.adj, self.columns = adj_maker(X, pairing_func,
+                                               symmetric=self._symmetric,
+                                               n_jobs=self.n_jobs,
+                                               tile_size=self.tile_size,
+                                               dtype=self.dtype,
+                                               mmap_path=self.mmap_path)
+            self._edge_array = None
+            if self.mmap_path is not None:
+                self._edge_array, self._edge_weights = _spanning_edges(self.adj, self._symmetric)
+
+        self._build(self.max_threshes, self.method, self.lazy, self.cache_size,
+                    self.sizes)
+        return self
+
+    def fit_chunks(self, chunks, max_threshes=None, method=None, n_jobs=None,
+                   lazy=None, cache_size=None):
+        '''Build graphs for the correlation pairing from chunks of rows.
+        Only a ``CorrelationAccumulator`` is kept while reading the chunks,
+        so a dataset larger than memory can be streamed. The adjacency
+        graph made from it is the one ``fit`` makes from the whole dataset.
+        Arguments which are not given are the Dendrogram's parameters,
+        and graphs are built at ``sizes`` if it is set. The Dendrogram's
+        ``pairing_func`` must be the default correlation pairing.
+
+        Args:
+            chunks (iterable[pd.DataFrame]): Dataframes with the same columns.
+            max_threshes (int): The maximum number of graphs to build.
+            method (str): Either 'thresholds' or 'merge_tree'. See ``fit``.
+            n_jobs (int): The number of processes across which to accumulate
+                chunks.
+            lazy (bool): If True compute the components at a step when the
+                step is first used. See ``fit``.
+            cache_size (int): The number of lazily computed steps to keep.
+
+        Returns:
+            The fitted Dendrogram. (Dendrogram)
+
+        Example:
+            >>> from henchman.selection import Dendrogram
+            >>> D = Dendrogram()
+            >>> D.fit_chunks(pd.read_csv('fm.csv', chunksize=100000))
+        '''
+        pairing_func = _NAMED_PAIRINGS.get(self.pairing_func, self.pairing_func)
+        assert pairing_func in (None, _one_minus_corr), \
+            'fit_chunks is only available for the default pairing_func'
+        max_threshes = self.max_threshes if max_threshes is None else max_threshes
+        method = self.method if method is None else method
+        n_jobs = self.n_jobs if n_jobs is None else n_jobs
+        lazy = self.lazy if lazy is None else lazy
+        cache_size = self.cache_size if cache_size is None else cache_size
+        assert method in ('thresholds', 'merge_tree')
+        accumulator = CorrelationAccumulator()
+        if n_jobs == 1:
+            for chunk in chunks:
+                accumulator.update(chunk)
+        else:
+            # Accumulate a batch of chunks at a time to bound memory
+            chunks = iter(chunks)
+            batch_size = cpu_count() if n_jobs < 0 else n_jobs
+            with Parallel(n_jobs=n_jobs) as parallel:
+                while True:
+                    batch = list(islice(chunks, batch_size))
+                    if not batch:
+                        break
+                    for other in parallel(delayed(CorrelationAccumulator().update)(chunk)
+                                          for chunk in batch):
+                        accumulator.merge(other)
+
+        self.adj = accumulator.adjacency()
+        self.columns = {i: col for i, col in enumerate(accumulator.columns)}
+        self._pairing_func = _one_minus_corr
+        self._symmetric = True
+        self._approx_thresh = None
+        self._edge_array = None
+        self._build(max_threshes, method, lazy, cache_size, self.sizes)
+        return self
+
+    def add_columns(self, X_new, X, n_jobs=None):
+        '''Add new columns to a fitted Dendrogram without refitting.
+        Only the pairings of the new columns with each other and with
+        the existing columns are computed. The new edges are merged into
+        the sorted edges and the components are rebuilt from the old
+        merges and the new edges, so an update costs about O(k * m) for
+        k existing and m new columns. Thresholds are kept as they are,
+        unless the Dendrogram was fit with ``sizes``, in which case the
+        thresholds of those sizes are found again. A memory mapped
+        adjacency graph is copied into memory.
+
+        Args:
+            X_new (pd.DataFrame): The new columns.
+            X (pd.DataFrame): A dataframe with the same rows as ``X_new`` and
+                the columns the Dendrogram was built with.
+            n_jobs (int): The number of processes used to evaluate
+                a pairing function which is not vectorized. Default is
+                the Dendrogram's ``n_jobs``.
+
+        Example:
+            >>> D = Dendrogram(X)
+            >>> D.add_columns(X_new, X)
+        '''
+        n_jobs = self.n_jobs if n_jobs is None else n_jobs
+        n_old = len(self.columns)
+        X = X[[self.columns[i] for i in range(n_old)]]
+        assert not set(X_new.columns) & set(X.columns), 'Columns already in Dendrogram'
+        # A Dendrogram loaded without its pairing cannot pair the new columns
+        assert getattr(self, '_pairing_func', None) is not None, \
+            'add_columns needs the pairing function the Dendrogram was fit with'
+        pairing_func = self._pairing_func
+        symmetric = self._symmetric
 
-        # Create adjacency matrix and columns list
-        self.adj, self.columns = adj_maker(X, pairing_func)
+        # Only the new rows and columns of the adjacency graph
+        top_right = _pairing_block(X, X_new, pairing_func, n_jobs)
+        if symmetric:
+            bottom_left = top_right.T
+        else:
+            bottom_left = _pairing_block(X_new, X, pairing_func, n_jobs)
+        bottom_right, _ = adj_maker(X_new, pairing_func, symmetric=symmetric, n_jobs=n_jobs)
 
-        # Make edges for every thresh
-        self._build_edges(max_threshes)
+        if self.adj is not None:
+            adj = np.empty((n_old + X_new.shape[1],) * 2, dtype=self.adj.dtype)
+            adj[:n_old, :n_old] = self.adj
+            adj[:n_old, n_old:] = top_right
+            adj[n_old:, :n_old] = bottom_left
+            adj[n_old:, n_old:] = bottom_right
+            self.adj = adj
+        for j, col in enumerate(X_new.columns):
+            self.columns[n_old + j] = col
 
-        # Make graphs for every thresh
-        self._build_graphs()
+        # Sort the new edges and insert them after old edges of equal weight
+        weights = np.fmin(top_right, bottom_left.T)
+        rows, cols = np.nonzero(~np.isnan(weights))
+        new_edges, new_weights = _edge_index(bottom_right)
+        new_edges = np.concatenate((np.column_stack((rows, cols + n_old)),
+                                    new_edges + n_old)).astype(np.int32)
+        new_weights = np.concatenate((weights[rows, cols], new_weights))
+        if self._approx_thresh is not None:
+            keep = new_weights <= self._approx_thresh
+            new_edges, new_weights = new_edges[keep], new_weights[keep]
+        order = np.argsort(new_weights, kind='mergesort')
+        positions = np.searchsorted(self._edge_weights, new_weights[order], side='right')
+        self._edge_array = np.insert(self.edges.edges, positions, new_edges[order], axis=0)
+        self._edge_weights = np.insert(self._edge_weights, positions, new_weights[order])
+
+        # The old merges and the new edges hold every merge of the new graph
+        new_positions = positions + np.arange(len(positions))
+        old_positions = np.delete(np.arange(len(self._edge_weights)), new_positions)
+        candidates = np.sort(np.concatenate((old_positions[self._merges], new_positions)))
+        n_vertices = len(self.columns)
+
+        if getattr(self, '_method', 'thresholds') == 'merge_tree':
+            self._merges = candidates[_find_merges(n_vertices, self._edge_array[candidates])]
+            self._set_merge_tree(self.threshlist[0])
+            return
+
+        if self.sizes is not None:
+            # The new edges move the thresholds at which there are ``sizes`` components
+            self._set_size_edges(self.sizes, candidates[_find_merges(
+                n_vertices, self._edge_array[candidates])])
+        else:
+            self._edge_offsets = np.searchsorted(self._edge_weights, self.threshlist,
+                                                 side='right')
+            self.edges = _EdgeSteps(self._edge_array, self._edge_offsets)
+        if isinstance(self.graphs, _MergeSteps):
+            self._merges = candidates[_find_merges(n_vertices, self._edge_array[candidates])]
+            self._set_lazy_graphs(self.graphs.cache_size)
+        else:
+            stops = np.searchsorted(self._edge_weights[candidates], self.threshlist,
+                                    side='right')
+            labels, merges = _merge_components(n_vertices, self._edge_array[candidates],
+                                               stops)
+            self._merges = candidates[merges]
+            self.graphs = _GraphSteps(labels)
+        connected = np.flatnonzero(self.graphs.n_components == 1)
+        if len(connected) > 0:
+            self.threshlist = self.threshlist[:connected[0]]
+            self.edges = self.edges[:connected[0]]
+            self.graphs = self.graphs[:connected[0]]
+
+    def _build(self, max_threshes, method, lazy=False, cache_size=16, sizes=None):
+        self._method = method
+        self._lazy = lazy
+        self._cache_size = cache_size
+        if method == 'merge_tree':
+            # Make edges and graphs for every merge
+            self._build_merge_tree()
+        else:
+            # A sparse edge list holds no edges past its last merge
+            sparse = getattr(self, '_edge_array', None) is not None
+            # Make edges for every thresh
+            self._build_edges(max_threshes, sizes)
+
+            # Make graphs for every thresh
+            self._build_graphs(truncate_last=sizes is None and not sparse)
 
         assert len(self.edges) > 0, 'Failed to build edges'
         assert len(self.graphs) > 0, 'Failed to build graphs'
@@ -125,28 +703,181 @@ class Dendrogram():
             setattr(self, key, params[key])
         return self
 
+    def get_params(self, deep=True):
+        '''Get the parameters of the Dendrogram.
+
+        Args:
+            deep (bool): Ignored, a Dendrogram holds no estimators.
+
+        Returns:
+            A dictionary of parameter names and values. (dict)
+        '''
+        return {name: getattr(self, name) for name in self._param_names}
+
+    def save(self, path):
+        '''Save a fitted Dendrogram to a directory.
+        Every array is stored as a ``.npy`` file so that it can be memory
+        mapped by ``Dendrogram.load``. Columns, thresholds, the kind of
+        graph storage and what ``add_columns`` needs to pair new columns
+        are stored in ``dendrogram.json``. A custom pairing function is not
+        saved, so a loaded Dendrogram made with one cannot add columns.
+
+        Args:
+            path (str): The directory to save to. Created if it does not exist.
+
+        Example:
+            >>> D.save('dendrogram')
+            >>> D = Dendrogram.load('dendrogram')
+        '''
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        arrays = {'adj': self.adj,
+                  'edge_array': self.edges.edges,
+                  'edge_weights': self._edge_weights,
+                  'edge_offsets': self.edges.offsets,
+                  'merges': self._merges}
+        meta = {'columns': [self.columns[i] for i in range(len(self.columns))],
+                'threshlist': [float(thresh) for thresh in self.threshlist],
+                'method': getattr(self, '_method', 'thresholds'),
+                'pairing_func': _pairing_name(getattr(self, '_pairing_func', None)),
+                'symmetric': getattr(self, '_symmetric', None),
+                'approx_thresh': getattr(self, '_approx_thresh', None)}
+        if meta['pairing_func'] is None and getattr(self, '_pairing_func', None) is not None:
+            print('Warning, the pairing function is not saved, '
+                  'so the loaded Dendrogram cannot add columns')
+        if isinstance(self.graphs, _MergeSteps):
+            arrays['merge_edges'] = self.graphs.merge_edges
+            arrays['merge_counts'] = self.graphs.merge_counts
+            meta['graphs'] = 'merge_tree'
+            meta['seed'] = self.graphs.seed
+            meta['cache_size'] = self.graphs.cache_size
+        else:
+            arrays['labels'] = self.graphs.labels
+            meta['graphs'] = 'labels'
+
+        for name, array in arrays.items():
+            filename = os.path.join(path, name + '.npy')
+            if array is not None:
+                np.save(filename, np.asarray(array))
+            elif os.path.exists(filename):
+                os.remove(filename)
+        with open(os.path.join(path, 'dendrogram.json'), 'w') as f:
+            json.dump(meta, f, default=lambda value: value.item())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''Load a Dendrogram saved with ``Dendrogram.save``.
+
+        Args:
+            path (str): The directory the Dendrogram was saved to.
+            mmap (bool): If True the arrays are memory mapped read only, so
+                processes loading the same Dendrogram share its memory.
+                Default is True.
+
+        Returns:
+            A fitted Dendrogram. (Dendrogram)
+        '''
+        mmap_mode = 'r' if mmap else None
+
+        def load_array(name):
+            filename = os.path.join(path, name + '.npy')
+            if not os.path.exists(filename):
+                return None
+            return np.load(filename, mmap_mode=mmap_mode)
+
+        with open(os.path.join(path, 'dendrogram.json')) as f:
+            meta = json.load(f)
+        D = cls()
+        D.adj = load_array('adj')
+        D.columns = {i: col for i, col in enumerate(meta['columns'])}
+        D.threshlist = meta['threshlist']
+        D._edge_array = load_array('edge_array')
+        D._edge_weights = load_array('edge_weights')
+        D._edge_offsets = load_array('edge_offsets')
+        D._merges = load_array('merges')
+        D._method = meta.get('method', 'merge_tree' if meta['graphs'] == 'merge_tree'
+                             else 'thresholds')
+        D._pairing_func = _NAMED_PAIRINGS.get(meta.get('pairing_func'))
+        D._symmetric = meta.get('symmetric')
+        D._approx_thresh = meta.get('approx_thresh')
+        D.edges = _EdgeSteps(D._edge_array, D._edge_offsets)
+        if meta['graphs'] == 'merge_tree':
+            D.graphs = _MergeSteps(load_array('merge_edges'), load_array('merge_counts'),
+                                   len(D.columns), meta['seed'],
+                                   meta.get('cache_size', 16))
+        else:
+            D.graphs = _GraphSteps(load_array('labels'))
+        return D
+
     def _find_all_graphs(self):
+        if getattr(self, '_lazy', False):
+            if getattr(self, '_merges', None) is None:
+                self._merges = _find_merges(len(self.columns), self._edge_array)
+            self._set_lazy_graphs(self._cache_size)
+            return
+        # Components only merge as the thresh grows, so one pass suffices
+        labels, self._merges = _merge_components(len(self.columns),
+                                                 self._edge_array,
+                                                 self._edge_offsets)
+        self.graphs = _GraphSteps(labels)
 
-        self.graphs = []
-        for edges in tqdm(self.edges):
-            out = find_connected_components(list(self.columns.keys()), edges)
-            self.graphs.append(out)
+    def _set_lazy_graphs(self, cache_size):
+        # The merges made by the edges at a thresh are a prefix of the merges
+        merge_counts = np.searchsorted(self._merges, self._edge_offsets)
+        self.graphs = _MergeSteps(self._edge_array[self._merges], merge_counts,
+                                  len(self.columns), cache_size=cache_size)
 
-    def _build_graphs(self):
-        if self.graphs == []:
+    def _build_graphs(self, truncate_last=True):
+        if len(self.graphs) == 0:
             self._find_all_graphs()
-        for i, graph in enumerate(self.graphs):
-            if len(graph) == 1:
-                break
+        connected = np.flatnonzero(self.graphs.n_components == 1)
+        if len(connected) > 0:
+            i = connected[0]
+        else:
+            i = len(self.graphs) - 1 if truncate_last else len(self.graphs)
         self.threshlist = self.threshlist[:i]
         self.edges = self.edges[:i]
         self.graphs = self.graphs[:i]
 
-    def _build_edges(self, max_threshes):
-        self.edges = []
-        self.graphs = []
-        uniques = list(np.unique(self.adj))
-        uniques = [x for x in uniques if not math.isnan(x)]
+    def _build_merge_tree(self):
+        n_vertices = len(self.columns)
+        if getattr(self, '_edge_array', None) is None:
+            self._edge_array, self._edge_weights = _edge_index(self.adj)
+            first_thresh = np.nanmin(self.adj)
+        else:
+            first_thresh = 0.
+        self._merges = _find_merges(n_vertices, self._edge_array)
+        self._set_merge_tree(first_thresh)
+
+    def _set_merge_tree(self, first_thresh):
+        n_vertices = len(self.columns)
+        # Step i is the graph after the first i merges, without the connected graph
+        n_steps = min(len(self._merges) + 1, n_vertices - 1)
+        self.threshlist = ([first_thresh] +
+                           list(self._edge_weights[self._merges]))[:n_steps]
+        self._edge_offsets = np.concatenate(([0], self._merges + 1))[:n_steps]
+        self.edges = _EdgeSteps(self._edge_array, self._edge_offsets)
+        self.graphs = _MergeSteps(self._edge_array[self._merges],
+                                  np.arange(n_steps), n_vertices,
+                                  cache_size=getattr(self, '_cache_size', 16))
+
+    def _build_edges(self, max_threshes, sizes=None):
+        self.graphs = _GraphSteps(np.zeros((0, 0), dtype=np.int32))
+        self._merges = None
+        if sizes is not None:
+            if getattr(self, '_edge_array', None) is None:
+                self._edge_array, self._edge_weights = _edge_index(self.adj)
+            self._set_size_edges(sizes)
+            return
+        if getattr(self, '_edge_array', None) is None:
+            # Sort every edge once, the edges at a thresh are then a prefix
+            self._edge_array, self._edge_weights = _edge_index(self.adj)
+            uniques = np.unique(self.adj)
+        else:
+            # Start at 0 as a dense graph does with its diagonal, where every
+            # column is its own component
+            uniques = np.unique(np.concatenate(([0.], self._edge_weights)))
+        uniques = list(uniques[~np.isnan(uniques)])
         if max_threshes is None and len(uniques) > 500:
             print('Calculating more than 500 graphs')
             print('You can pass max_threshes as a kwarg to Dendrogram')
@@ -156,9 +887,34 @@ class Dendrogram():
                 uniques = uniques[::int(np.floor((len(uniques)/max_threshes)) + 1)]
 
         self.threshlist = uniques
+        self._edge_offsets = np.searchsorted(self._edge_weights, self.threshlist,
+                                             side='right')
+        self.edges = _EdgeSteps(self._edge_array, self._edge_offsets)
+
+    def _set_size_edges(self, sizes, merges=None):
+        n_vertices = len(self.columns)
+        # The components only change at merges, so the thresh at which
+        # there are first ``size`` components is the weight of a merge
+        if merges is None:
+            merges = _find_merges(n_vertices, self._edge_array)
+        self._merges = merges
+        merge_weights = self._edge_weights[self._merges]
+        threshes = set()
+        for size in sizes:
+            n_merges = n_vertices - size
+            if n_merges < 1:
+                print("Skipping size {}, there are only {} columns".format(size, n_vertices))
+                continue
+            if n_merges > len(merge_weights):
+                print("Warning, could not find requested size, using size {}".format(
+                    n_vertices - len(merge_weights)))
+                n_merges = len(merge_weights)
+            threshes.add(merge_weights[n_merges - 1])
 
-        for thresh in tqdm(self.threshlist):
-            self.edges.append(_edge_maker(self.adj, thresh))
+        self.threshlist = sorted(threshes)
+        self._edge_offsets = np.searchsorted(self._edge_weights, self.threshlist,
+                                             side='right')
+        self.edges = _EdgeSteps(self._edge_array, self._edge_offsets)
 
     def features_at_step(self, step):
         '''Find the representatives at a certain step for a given graph.
@@ -169,7 +925,7 @@ class Dendrogram():
         Returns:
             A list of features at ``step``. (list[str])
         '''
-        featurelist = [self.columns[x] for x, _ in self.graphs[step].items()]
+        featurelist = [self.columns[x] for x in self.graphs.representatives(step)]
         return featurelist
 
     def score_at_point(self, X, y, model, metric, step, n_splits=1):
@@ -207,6 +963,85 @@ class Dendrogram():
         self.shuffle_all_representatives()
         return self.score_at_point(X, y, model, metric, step, n_splits=n_splits)
 
+    def representative_stability(self, X, y, model, metric, step, n_draws=10,
+                                 n_splits=1, n_jobs=1, random_state=None):
+        '''Score many random choices of representatives at a step.
+        Every draw picks a random member of each component at ``step``
+        and scores a copy of ``model`` on those features. Unlike
+        ``shuffle_score_at_point`` only the requested step is redrawn,
+        the draws are scored in parallel and the Dendrogram is unchanged.
+
+        Args:
+            X (pd.DataFrame): A dataframe with the same columns that the
+                Dendrogram was built with.
+            y (pd.Series): Labels for X.
+            model: A sklearn model with fit and predict methods.
+            metric: A metric which takes y_test, preds and returns a score.
+            step (int): Which position in self.threshlist to draw features from.
+            n_draws (int): The number of feature sets to draw. Default is 10.
+            n_splits (int): If 1 use a train_test_split. Otherwise use tssplit.
+                Default value is 1.
+            n_jobs (int): The number of processes to score with. Default is 1.
+            random_state (int): Seed for the draws.
+
+        Returns:
+            An array with the mean score of every draw. (np.array)
+
+        Example:
+            >>> scores = D.representative_stability(X, y, RandomForestClassifier(),
+            ...                                     roc_auc_score, step=10, n_draws=50)
+            >>> print('{:.3f} +/- {:.3f}'.format(scores.mean(), scores.std()))
+        '''
+        rng = np.random.RandomState(random_state)
+        labels = self.graphs.labels_at(step)
+        featuresets = []
+        for _ in range(n_draws):
+            drawn = _draw_representatives(labels, rng)
+            featuresets.append([self.columns[x]
+                                for x in np.flatnonzero(drawn == np.arange(len(drawn)))])
+        scores = Parallel(n_jobs=n_jobs)(
+            delayed(_score_features)(X, y, clone(model), metric, features, n_splits)
+            for features in featuresets)
+        return np.array([np.mean(scorelist) for scorelist in scores])
+
+    def score_path(self, X, y, model, metric, steps=None, n_splits=1, n_jobs=-1):
+        '''Score the features of many steps in parallel.
+        A copy of ``model`` is fit for every step in a pool of processes.
+        Every process is sent the whole of ``X`` and selects the columns of its
+        step itself, and joblib memory maps large arrays so ``X`` is shared
+        read only instead of copied to each task.
+
+        Args:
+            X (pd.DataFrame): A dataframe with the same columns that the
+                Dendrogram was built with.
+            y (pd.Series): Labels for X.
+            model: A sklearn model with fit and predict methods.
+            metric: A metric which takes y_test, preds and returns a score.
+            steps (list[int]): The steps to score. Default is every step.
+            n_splits (int): If 1 use a train_test_split. Otherwise use tssplit.
+                Default value is 1.
+            n_jobs (int): The number of processes to score with. Default is -1,
+                which uses every core.
+
+        Returns:
+            A dataframe with a row for the score of every split at every step
+            and columns step, thresh, n_features, split and score. (pd.DataFrame)
+
+        Example:
+            >>> path = D.score_path(X, y, RandomForestClassifier(), roc_auc_score)
+            >>> path.groupby('n_features').score.mean().plot()
+        '''
+        if steps is None:
+            steps = range(len(self.graphs))
+        featuresets = [self.features_at_step(step) for step in steps]
+        scores = Parallel(n_jobs=n_jobs)(
+            delayed(_score_features)(X, y, clone(model), metric, features, n_splits)
+            for features in featuresets)
+        rows = [(step, self.threshlist[step], len(features), split, score)
+                for step, features, scorelist in zip(steps, featuresets, scores)
+                for split, score in enumerate(scorelist)]
+        return pd.DataFrame(rows, columns=['step', 'thresh', 'n_features', 'split', 'score'])
+
     def find_set_of_size(self, size):
         '''Finds a column set of a certain size in the Dendrogram.
         This checks graphs until there are only ``size`` remaining components.
@@ -217,18 +1052,18 @@ class Dendrogram():
         Returns:
             The step at which there are ``size`` connected components. (int)
         '''
-        for i, graph in enumerate(self.graphs):
-            if len(graph.keys()) <= size:
-                print("There are {} distinct connected components "
-                      "at thresh step {} in the Dendrogram".format(
-                          len(graph.keys()), i))
-                if i > 0:
-                    prevlength = len(self.graphs[i - 1].keys())
-                    print("You might also be interested in"
-                          " {} components at step {}".format(prevlength, i - 1))
-                return i
+        n_components = self.graphs.n_components
+        # n_components never increases, so search it from the right
+        i = np.searchsorted(-n_components, -size, side='left')
+        if i < len(n_components):
+            print("There are {} distinct connected components "
+                  "at thresh step {} in the Dendrogram".format(n_components[i], i))
+            if i > 0:
+                print("You might also be interested in"
+                      " {} components at step {}".format(n_components[i - 1], i - 1))
+            return i
         print("Warning, could not find requested size, returning set of size {}".format(
-            len(self.graphs[-1])))
+            n_components[-1]))
         return (len(self.graphs) - 1)
 
     def shuffle_all_representatives(self):
@@ -238,63 +1073,748 @@ class Dendrogram():
         are not fixed step by step, so the key for a cluster at step n
         is not guarenteed to be the key for the same cluster at step n+1.
         '''
-        assert self.graphs != [], 'Run D._build_graphs to get a graph'
-        templist = []
-        for graph in self.graphs:
-            temp = defaultdict(set)
-            for key in graph.keys():
-                newkey = random.choice(list(graph[key]))
-                temp[newkey] = graph[key]
-            templist.append(temp)
-        self.graphs = templist
-
-    def transform(self, X, n_feats=10):
+        assert len(self.graphs) > 0, 'Run D._build_graphs to get a graph'
+        self.graphs = self.graphs.shuffled(np.random)
+
+    def transform(self, X, n_feats=None):
         '''Return a dataframe of a particular size.
 
         Args:
             X (pd.Dataframe): The dataframe to transform.
-            n_feats (int): The number of columns to return
+            n_feats (int): The number of columns to return. Default is
+                ``self.n_feats``.
         '''
+        X = pd.DataFrame(X)
+        if n_feats is None:
+            n_feats = self.n_feats
         assert X.shape[1] >= n_feats
         step = self.find_set_of_size(n_feats)
         return X[self.features_at_step(step)]
 
 
-def adj_maker(data, pairing_func):
+class CorrelationAccumulator(object):
+    """Mergeable statistics for the correlations between columns.
+    """
+
+    def __init__(self):
+        '''Accumulates the row count, column means and co-moment matrix
+        of a sequence of dataframes. Accumulators of different chunks can be
+        merged, so chunks may be accumulated in parallel.
+        '''
+        self.columns = None
+        self.count = 0
+        self.means = None
+        self.comoments = None
+
+    def update(self, X):
+        '''Add the rows of a dataframe.
+
+        Args:
+            X (pd.DataFrame): A numeric dataframe.
+
+        Returns:
+            The accumulator. (CorrelationAccumulator)
+        '''
+        values = np.asarray(X, dtype=float)
+        chunk = CorrelationAccumulator()
+        chunk.columns = list(pd.DataFrame(X).columns)
+        chunk.count = values.shape[0]
+        chunk.means = values.mean(axis=0)
+        centered = values - chunk.means
+        chunk.comoments = centered.T.dot(centered)
+        return self.merge(chunk)
+
+    def merge(self, other):
+        '''Add the rows accumulated by another accumulator.
+
+        Args:
+            other (CorrelationAccumulator): An accumulator of the same columns.
+
+        Returns:
+            The accumulator. (CorrelationAccumulator)
+        '''
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.columns = other.columns
+            self.count = other.count
+            self.means = other.means.copy()
+            self.comoments = other.comoments.copy()
+            return self
+        assert list(self.columns) == list(other.columns), 'Columns do not match'
+
+        # Pairwise update of the means and co-moments
+        count = self.count + other.count
+        delta = other.means - self.means
+        self.comoments += other.comoments + np.outer(delta, delta) * (
+            self.count * other.count / float(count))
+        self.means += delta * other.count / float(count)
+        self.count = count
+        return self
+
+    def adjacency(self):
+        '''Make the ``_one_minus_corr`` adjacency graph of the accumulated rows.
+        '''
+        scale = np.sqrt(np.diag(self.comoments))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.clip(self.comoments / np.outer(scale, scale), -1, 1)
+        np.fill_diagonal(corr, np.where(scale > 0, 1, np.nan))
+        return 1 - np.abs(corr)
+
+
+class _EdgeSteps(object):
+    '''The edges at every step of a Dendrogram.
+    Every step holds a prefix of one array of edges sorted by weight,
+    so only the prefix lengths are stored per step.
+    '''
+
+    def __init__(self, edges, offsets):
+        self.edges = edges
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, step):
+        if isinstance(step, slice):
+            return _EdgeSteps(self.edges, self.offsets[step])
+        return self.edges[:self.offsets[step]]
+
+
+class _GraphSteps(object):
+    '''The connected components at every step of a Dendrogram.
+    Stored as one int32 array whose row ``step`` labels every vertex
+    with the representative of its component. Indexing a step gives the
+    graph dictionary of representatives and their components.
+    '''
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.n_components = (labels == np.arange(labels.shape[1])).sum(axis=1)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, step):
+        if isinstance(step, slice):
+            return _GraphSteps(self.labels[step])
+        return _labels_to_graph(self.labels[step])
+
+    def labels_at(self, step):
+        return self.labels[step]
+
+    def representatives(self, step):
+        labels = self.labels_at(step)
+        return np.flatnonzero(labels == np.arange(len(labels)))
+
+    def shuffled(self, rng):
+        '''Draw a random representative for every component at every step.
+        '''
+        return _GraphSteps(np.array([_draw_representatives(labels, rng)
+                                     for labels in self.labels], dtype=np.int32))
+
+
+class _MergeSteps(_GraphSteps):
+    '''The connected components at every step of a Dendrogram, as a merge log.
+    Step ``step`` holds the components after the first ``merge_counts[step]``
+    merges, which are replayed on access, so no per-step labels are stored.
+    The labels of the ``cache_size`` most recently used steps are kept.
+    If ``seed`` is given each step's representatives are drawn at random.
+    '''
+
+    def __init__(self, merge_edges, merge_counts, n_vertices, seed=None, cache_size=16):
+        self.merge_edges = merge_edges
+        self.merge_counts = np.asarray(merge_counts, dtype=np.int64)
+        self.n_vertices = n_vertices
+        self.seed = seed
+        self.cache_size = cache_size
+        self.n_components = n_vertices - self.merge_counts
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.merge_counts)
+
+    def __getitem__(self, step):
+        if isinstance(step, slice):
+            assert step.start in (None, 0), 'Only prefixes of steps can be taken'
+            return _MergeSteps(self.merge_edges, self.merge_counts[step],
+                               self.n_vertices, self.seed, self.cache_size)
+        return _labels_to_graph(self.labels_at(step))
+
+    def labels_at(self, step):
+        step = range(len(self))[step]
+        if step in self._cache:
+            labels = self._cache.pop(step)
+        else:
+            labels = _replay_merges(self.n_vertices,
+                                    self.merge_edges[:self.merge_counts[step]])
+            if self.seed is not None:
+                labels = _draw_representatives(labels,
+                                               np.random.RandomState(self.seed + step))
+        # The most recently used step goes last and the oldest is evicted
+        self._cache[step] = labels
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return labels
+
+    def shuffled(self, rng):
+        return _MergeSteps(self.merge_edges, self.merge_counts, self.n_vertices,
+                           seed=rng.randint(2 ** 30), cache_size=self.cache_size)
+
+
+def register_matrix_pairing(pairing_func, matrix_func):
+    '''Register a vectorized version of a pairing function.
+    When ``adj_maker`` is given ``pairing_func`` it will build the
+    whole adjacency matrix with a single call to ``matrix_func``
+    instead of calling ``pairing_func`` on every pair of columns.
+
+    Args:
+        pairing_func (func): A function which takes in two columns and
+            returns a number.
+        matrix_func (func): A function which takes in two dataframes ``A``
+            and ``B`` and returns an array of shape ``(A.shape[1], B.shape[1])``
+            whose ``(i, j)`` entry is the pairing of column i of ``A``
+            with column j of ``B``.
+
+    Example:
+        >>> from henchman.selection import register_matrix_pairing
+        >>> register_matrix_pairing(my_pairing, my_matrix_pairing)
+    '''
+    _MATRIX_PAIRINGS[pairing_func] = matrix_func
+
+
+def adj_maker(data, pairing_func, symmetric=False, n_jobs=1,
+              tile_size=None, dtype=np.float64, mmap_path=None):
     '''Given a dataframe and a pairing function make
     an adjacency graph and a dictionary of columns.
     The dictionary can be used to associate column position
-    to column name.
+    to column name. If ``pairing_func`` has been registered
+    with ``register_matrix_pairing`` the adjacency graph is
+    built in one vectorized call.
 
     Args:
         data (pd.DataFrame): A dataframe from which to make an
             adjacency graph.
         pairing_function (func): A function which takes in two columns
-            and returns a number.
+            and returns a number, or the name of a built in pairing.
+            See ``Dendrogram``.
+        symmetric (bool): If True assume ``pairing_func`` is symmetric and only
+            evaluate it for pairs of distinct columns in the upper triangle.
+            The diagonal is set to 0, so that a Dendrogram's first step
+            has every column in its own component. Default is False.
+        n_jobs (int): The number of processes across which to spread the
+            pairs. Columns are shared with the workers through memory maps.
+            -1 means use all processors. Default is 1.
+        tile_size (int): If given, a registered matrix pairing is computed
+            ``tile_size`` columns against ``tile_size`` columns at a time,
+            which bounds the memory used on top of the adjacency graph.
+            With ``symmetric`` only the upper tiles are computed. The
+            categorical pairings factorize every column once up front and
+            keep the integer codes for all tiles.
+        dtype (np.dtype): The dtype of the adjacency graph. Default is float64.
+        mmap_path (str): If given, the adjacency graph is a ``np.memmap``
+            stored at this path rather than an array in memory. A registered
+            matrix pairing is then computed in tiles of 1024 columns unless
+            ``tile_size`` is given, and any other pairing function is
+            evaluated and written a block of rows at a time.
 
     Returns:
         adj, columns (np.array, dict[int, str]): An adjacency graph
             and a dictionary pairing column locations with column names.
     '''
-    adj = np.zeros((data.shape[1], data.shape[1]))
-    for i, col1 in enumerate(data):
-        for j, col2 in enumerate(data):
-            adj[j][i] = pairing_func(data[col1], data[col2])
-
     columns = {i: col for i, col in enumerate(data)}
-    return adj, columns
+    n_cols = data.shape[1]
+    pairing_func = _NAMED_PAIRINGS.get(pairing_func, pairing_func)
+    if pairing_func in _MATRIX_PAIRINGS:
+        matrix_func = _MATRIX_PAIRINGS[pairing_func]
+        if tile_size is None and mmap_path is None:
+            return np.asarray(matrix_func(data, data), dtype=dtype), columns
+
+        adj = _empty_adjacency(n_cols, dtype, mmap_path)
+        if tile_size is None:
+            # A memory mapped graph is never held in memory whole
+            tile_size = n_cols if mmap_path is None else _MMAP_TILE_SIZE
+        tile_size = max(tile_size, 1)
+        if pairing_func in _CATEGORICAL_PAIRINGS:
+            # Factorize every column once rather than once for every tile
+            data = _Codes(*_categorical_codes(data))
+        for start in range(0, n_cols, tile_size):
+            tile = slice(start, start + tile_size)
+            block = _tile_columns(data, tile)
+            adj[tile, tile] = matrix_func(block, block)
+            for other_start in range(start + tile_size if symmetric else 0, n_cols, tile_size):
+                if other_start == start:
+                    continue
+                other = slice(other_start, other_start + tile_size)
+                values = matrix_func(block, _tile_columns(data, other))
+                adj[tile, other] = values
+                if symmetric:
+                    adj[other, tile] = values.T
+        return _flush(adj), columns
+
+    if not symmetric and n_jobs == 1:
+        adj = _empty_adjacency(n_cols, dtype, mmap_path)
+        for i, col1 in enumerate(data):
+            for j, col2 in enumerate(data):
+                adj[j][i] = pairing_func(data[col1], data[col2])
+        return _flush(adj), columns
+
+    adj = _empty_adjacency(n_cols, dtype, mmap_path)
+    adj[:] = np.nan
+    if symmetric:
+        np.fill_diagonal(adj, 0)
+    # Fill a block of rows at a time, so the values of every pair are
+    # never held in memory at once
+    block_size = max(1, _PAIRS_PER_BLOCK // max(n_cols, 1))
+    for start in range(0, n_cols, block_size):
+        block_rows = np.arange(start, min(start + block_size, n_cols))
+        if symmetric:
+            # Pairs (i, j) with i < j for every j in the block
+            cols = np.repeat(block_rows, block_rows)
+            rows = np.arange(len(cols)) - np.repeat(np.cumsum(block_rows) - block_rows,
+                                                    block_rows)
+        else:
+            cols = np.repeat(block_rows, n_cols)
+            rows = np.tile(np.arange(n_cols), len(block_rows))
+        values = _evaluate_pairs(data, pairing_func, rows, cols, n_jobs)
+        adj[cols, rows] = values
+        if symmetric:
+            adj[rows, cols] = values
+    return _flush(adj), columns
+
 
+def _empty_adjacency(n_cols, dtype, mmap_path):
+    if mmap_path is None:
+        return np.empty((n_cols, n_cols), dtype=dtype)
+    return np.memmap(mmap_path, dtype=dtype, mode='w+', shape=(n_cols, n_cols))
 
-def _edge_maker(adj, thresh):
-    '''Make all edges at a given threshold. Prerequisite
-    to make the associated graph.
+
+def _flush(adj):
+    if isinstance(adj, np.memmap):
+        adj.flush()
+    return adj
+
+
+def _pairing_block(A, B, pairing_func, n_jobs=1):
+    '''Make the block of an adjacency graph whose rows are the columns
+    of A and whose columns are the columns of B.
+    '''
+    if pairing_func in _MATRIX_PAIRINGS:
+        return np.asarray(_MATRIX_PAIRINGS[pairing_func](A, B), dtype=float)
+    # As in adj_maker, adj[j][i] pairs column i with column j
+    data = pd.concat([A, B], axis=1)
+    rows, cols = np.indices((A.shape[1], B.shape[1])).reshape(2, -1)
+    values = _evaluate_pairs(data, pairing_func, cols + A.shape[1], rows, n_jobs)
+    return values.reshape(A.shape[1], B.shape[1])
+
+
+def _evaluate_pairs(data, pairing_func, rows, cols, n_jobs):
+    '''Evaluate ``pairing_func`` on column pairs, split across n_jobs processes.
+    '''
+    if n_jobs == 1:
+        return _pairing_chunk(data, pairing_func, rows, cols)
+    n_chunks = 4 * (cpu_count() if n_jobs < 0 else n_jobs)
+    chunks = np.array_split(np.arange(len(rows)), n_chunks)
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_pairing_chunk)(data, pairing_func, rows[chunk], cols[chunk])
+        for chunk in chunks if len(chunk) > 0)
+    return np.concatenate(results) if results else np.zeros(0)
+
+
+def _pairing_chunk(data, pairing_func, rows, cols):
+    '''Evaluate ``pairing_func`` on the column pairs (rows[k], cols[k]).
+    '''
+    return np.array([pairing_func(data.iloc[:, i], data.iloc[:, j])
+                     for i, j in zip(rows, cols)], dtype=float)
+
+
+def _edge_index(adj):
+    '''Make every edge of an adjacency graph, sorted by weight.
+    The edge between columns i < j has weight ``min(adj[i][j], adj[j][i])``
+    and pairs whose weight is NaN have no edge. The edges at a given
+    threshold are the prefix of edges whose weight is at most that threshold.
+
+    Returns:
+        edges, weights (np.array, np.array): An array of shape (n_edges, 2)
+            of vertex pairs and the sorted array of their weights.
     '''
-    it = np.nditer(adj, flags=['multi_index'])
+    rows, cols = np.triu_indices(adj.shape[0], k=1)
+    weights = np.fmin(adj[rows, cols], adj[cols, rows])
+    keep = ~np.isnan(weights)
+    weights = weights[keep]
+    order = np.argsort(weights, kind='mergesort')
+    edges = np.column_stack((rows[keep], cols[keep])).astype(np.int32)[order]
+    return edges, weights[order]
+
+
+def _spanning_edges(adj, symmetric=False):
+    '''Find a minimum spanning forest of an adjacency graph.
+    This is Prim's algorithm, reading ``adj`` one row and column at a
+    time so that a memory mapped adjacency graph is never loaded into
+    memory. The forest has the same connected components as the full
+    graph at every threshold. As in ``_edge_index`` the edge between
+    i and j has weight ``min(adj[i][j], adj[j][i])``, and NaN is no edge.
+
+    Args:
+        adj (np.array): An adjacency graph.
+        symmetric (bool): If True only read rows, assuming they equal the
+            columns. Default is False.
+
+    Returns:
+        edges, weights (np.array, np.array): As in ``_edge_index``, for the
+            edges of the forest.
+    '''
+    n_vertices = adj.shape[0]
+    dist = np.full(n_vertices, np.inf)
+    nearest = np.zeros(n_vertices, dtype=np.int64)
+    unvisited = np.ones(n_vertices, dtype=bool)
     edges = []
-    for val in it:
-        if val <= thresh:
-            edges.append(it.multi_index)
-    return edges
+    weights = []
+    for _ in range(n_vertices):
+        candidates = np.where(unvisited, dist, np.inf)
+        vertex = int(np.argmin(candidates))
+        if np.isinf(candidates[vertex]):
+            # Start a new tree at the first unvisited vertex
+            vertex = int(np.argmax(unvisited))
+        else:
+            edges.append(sorted((vertex, nearest[vertex])))
+            weights.append(dist[vertex])
+        unvisited[vertex] = False
+
+        row = np.asarray(adj[vertex], dtype=float)
+        if not symmetric:
+            row = np.fmin(row, adj[:, vertex])
+        closer = unvisited & (row < dist)
+        dist[closer] = row[closer]
+        nearest[closer] = vertex
+
+    weights = np.array(weights, dtype=float)
+    order = np.argsort(weights, kind='mergesort')
+    edges = np.array(edges, dtype=np.int32).reshape(-1, 2)[order]
+    return edges, weights[order]
+
+
+def _approximate_edge_index(data, max_thresh, n_bands=None, band_bits=None,
+                            random_state=None, max_bucket=256):
+    '''Find the edges of the ``_one_minus_corr`` adjacency graph whose weight
+    is at most ``max_thresh`` without making the adjacency graph.
+    Every standardized column is hashed by the signs of random projections,
+    and columns which share a hash in any band are candidate pairs. The
+    angle between candidates is estimated from all of their signs, and the
+    plausible candidates are checked exactly. No false edges are kept, but
+    some edges with a weight close to ``max_thresh`` may be missed.
+
+    With ``band_bits`` about log2 of the number of columns, unrelated
+    columns share a hash in a band with about one other column, so the
+    number of candidate pairs grows with the number of columns times
+    ``n_bands`` rather than with its square.
+
+    Args:
+        data (pd.DataFrame): A numeric dataframe.
+        max_thresh (float): The largest edge weight to keep.
+        n_bands (int): The number of hashes per column. More bands miss fewer
+            edges. By default, enough bands that an edge of weight
+            ``max_thresh`` is found nine times in ten, and at most 100.
+        band_bits (int): The number of projections per hash. More bits give
+            fewer candidate pairs. Default is one more than log2 of the
+            number of columns, since every hash gives up a bit so that
+            anti-correlated columns hash together.
+        random_state (int): Seed for the random projections.
+        max_bucket (int): Columns sharing a hash in a band are split further
+            by the hashes of the next bands while there are more than this
+            many of them. Default is 256.
+
+    Returns:
+        edges, weights (np.array, np.array): As in ``_edge_index``.
+    '''
+    z = _standardize(data)
+    n_rows, n_cols = z.shape
+    valid = np.flatnonzero(~np.isnan(z).any(axis=0))
+    # One contiguous row per column makes gathering candidate pairs cheap
+    z = np.ascontiguousarray(z[:, valid].T)
+    band_bits, n_bands = _band_shape(len(valid), max_thresh, n_bands, band_bits)
+
+    rng = np.random.RandomState(random_state)
+    n_signs = n_bands * band_bits
+    signs = z.dot(rng.randn(n_rows, n_signs)) > 0
+    packed = np.packbits(signs, axis=1)
+    signs = signs.reshape(len(valid), n_bands, band_bits)
+    # Flip bands whose first sign is set so that z and -z hash together
+    signs ^= signs[:, :, :1]
+    keys = signs.dot(1 << np.arange(band_bits, dtype=np.int64))
+    rows, cols = _candidate_pairs(keys, max_bucket)
+
+    # The share of differing signs estimates the angle between two columns,
+    # drop candidates more than four standard errors past the cutoff.
+    # Plausible candidates get exact weights, a chunk at a time.
+    max_angle = np.arccos(np.clip(1 - max_thresh, -1, 1)) + 2 * np.pi / np.sqrt(n_signs)
+    kept_rows, kept_cols, kept_weights = [], [], []
+    chunk = max(1, 10 ** 7 // max(n_rows, packed.shape[1], 1))
+    for start in range(0, len(rows), chunk):
+        window = slice(start, start + chunk)
+        chunk_rows, chunk_cols = rows[window], cols[window]
+        differing = _POPCOUNT[packed[chunk_rows] ^ packed[chunk_cols]].sum(axis=1)
+        angles = np.pi * differing / float(n_signs)
+        plausible = np.minimum(angles, np.pi - angles) <= max_angle
+        chunk_rows, chunk_cols = chunk_rows[plausible], chunk_cols[plausible]
+
+        corr = np.einsum('ij,ij->i', z[chunk_rows], z[chunk_cols])
+        weights = 1 - np.abs(np.clip(corr, -1, 1))
+        keep = weights <= max_thresh
+        kept_rows.append(chunk_rows[keep])
+        kept_cols.append(chunk_cols[keep])
+        kept_weights.append(weights[keep])
+
+    rows = np.concatenate(kept_rows) if kept_rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(kept_cols) if kept_cols else np.zeros(0, dtype=np.int64)
+    weights = np.concatenate(kept_weights) if kept_weights else np.zeros(0)
+    order = np.argsort(weights, kind='mergesort')
+    edges = np.column_stack((valid[rows], valid[cols])).astype(np.int32)[order]
+    return edges, weights[order]
+
+
+def _band_shape(n_cols, max_thresh, n_bands=None, band_bits=None):
+    '''Fill in the defaults of ``_approximate_edge_index``.
+
+    Returns:
+        band_bits, n_bands (int, int)
+    '''
+    if band_bits is None:
+        band_bits = int(np.ceil(np.log2(max(n_cols, 2)))) + 1
+    if n_bands is None:
+        # Each sign of a pair at max_thresh agrees with this probability,
+        # and a band hashes the pair together if all or none of them agree
+        agree = 1 - np.arccos(np.clip(1 - max_thresh, -1, 1)) / np.pi
+        collide = agree ** band_bits + (1 - agree) ** band_bits
+        n_bands = int(np.ceil(np.log(.1) / np.log1p(-min(collide, .5))))
+        n_bands = min(max(n_bands, 1), 100)
+    return band_bits, n_bands
+
+
+def _candidate_pairs(keys, max_bucket=256):
+    '''Find the pairs of items which share a key in any band.
+    Buckets of more than ``max_bucket`` items are split by the keys
+    of the following bands, so that only items sharing those keys too
+    are paired.
+
+    Args:
+        keys (np.array): An array of shape (n_items, n_bands).
+        max_bucket (int): The largest bucket which is not split further.
+
+    Returns:
+        rows, cols (np.array, np.array): The pairs, with rows < cols.
+    '''
+    n_items, n_bands = keys.shape
+    pairs = [np.zeros(0, dtype=np.int64)]
+    for band in range(n_bands):
+        buckets = []
+        _split_bucket(np.arange(n_items), keys, band, 0, max_bucket, buckets)
+        for members in buckets:
+            size = members.shape[1]
+            first, second = np.triu_indices(size, k=1)
+            members = np.sort(members, axis=1)
+            pairs.append((members[:, first] * n_items + members[:, second]).ravel())
+        if band % 8 == 7:
+            # Drop the pairs found in earlier bands as we go to bound memory
+            pairs = [np.unique(np.concatenate(pairs))]
+    return np.divmod(np.unique(np.concatenate(pairs)), max(n_items, 1))
+
+
+def _split_bucket(members, keys, band, depth, max_bucket, buckets):
+    '''Group ``members`` by their keys in band ``band + depth``.
+    Appends to ``buckets`` an array of shape (n_buckets, size) for every
+    size of bucket with at least two members.
+    '''
+    n_bands = keys.shape[1]
+    band_keys = keys[members, (band + depth) % n_bands]
+    order = np.argsort(band_keys, kind='mergesort')
+    members = members[order]
+    band_keys = band_keys[order]
+    starts = np.flatnonzero(np.r_[True, band_keys[1:] != band_keys[:-1]])
+    sizes = np.diff(np.r_[starts, len(members)])
+    large = sizes > max_bucket
+    if depth + 1 < n_bands:
+        for start, size in zip(starts[large], sizes[large]):
+            _split_bucket(members[start:start + size], keys, band, depth + 1,
+                          max_bucket, buckets)
+        keep = (sizes > 1) & ~large
+    else:
+        keep = sizes > 1
+    for size in np.unique(sizes[keep]):
+        bucket_starts = starts[keep & (sizes == size)]
+        buckets.append(members[bucket_starts[:, None] + np.arange(size)])
+
+
+def _merge_components(n_vertices, edges, stops, record_labels=True):
+    '''Run a union-find over sorted edges and record the components as it goes.
+    Components only ever merge as edges are added, so every edge is
+    processed once and a labelling is recorded at each stop. Every vertex
+    is labelled by the smallest vertex in its component.
+
+    Args:
+        n_vertices (int): The number of vertices.
+        edges (np.array): An array of shape (n_edges, 2) of sorted edges.
+        stops (list[int]): Increasing numbers of edges after which to
+            record the labels.
+        record_labels (bool): If False only the merges are returned.
+
+    Returns:
+        labels, merges (np.array, np.array): An int32 array whose row i
+            labels every vertex at stop i and the positions in ``edges``
+            of the edges which merged two components.
+    '''
+    parent = np.arange(n_vertices)
+    n_components = n_vertices
+    labels = np.empty((len(stops) if record_labels else 0, n_vertices), dtype=np.int32)
+    merges = []
+    start = 0
+    for i, stop in enumerate(stops):
+        if n_components > 1:
+            # parent is flat here, so edges within a component drop out at once
+            roots = parent[edges[start:stop]]
+            for position in np.flatnonzero(roots[:, 0] != roots[:, 1]):
+                root_a = _find_root(parent, roots[position, 0])
+                root_b = _find_root(parent, roots[position, 1])
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+                    merges.append(start + position)
+                    n_components -= 1
+            parent = _flatten(parent)
+        elif not record_labels:
+            break
+        if record_labels:
+            labels[i] = parent
+        start = stop
+    return labels, np.array(merges, dtype=int)
+
+
+def set_fit_cache(max_bytes=2 ** 28):
+    '''Keep fitted Dendrogram structures for reuse by ``Dendrogram.fit``.
+    Refitting a Dendrogram on the same data with the same graph parameters,
+    for instance while ``n_feats`` is tuned in a ``GridSearchCV``, then
+    reuses the adjacency graph and graphs instead of building them again.
+    Once the kept structures hold more than ``max_bytes``, the least
+    recently used are dropped. Kept structures stay in memory after the
+    Dendrograms which made them are deleted.
+
+    The cache is kept in memory by each process, so fits in joblib worker
+    processes, such as a ``GridSearchCV`` with ``n_jobs`` other than 1,
+    do not share it.
+
+    Args:
+        max_bytes (int): The largest size of the kept structures. If None,
+            turn the cache off and drop everything in it. Default is 256MB.
+
+    Example:
+        >>> from henchman.selection import set_fit_cache
+        >>> set_fit_cache(2 ** 30)
+    '''
+    _FIT_CACHE['max_bytes'] = max_bytes
+    if max_bytes is None:
+        _FIT_CACHE['fits'].clear()
+        _FIT_CACHE['nbytes'] = 0
+        return
+    fits = _FIT_CACHE['fits']
+    while fits and _FIT_CACHE['nbytes'] > max_bytes:
+        _FIT_CACHE['nbytes'] -= fits.popitem(last=False)[1][1]
+
+
+def _nbytes(value):
+    '''The rough size in bytes of a fitted state, counting the arrays it holds.
+    '''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item) for item in value)
+    if hasattr(value, '__dict__') and not callable(value):
+        return _nbytes(vars(value))
+    return sys.getsizeof(value)
+
+
+def _fingerprint(X):
+    '''A hash of the columns, dtypes and values of a dataframe.
+    '''
+    X = pd.DataFrame(X)
+    digest = hashlib.sha1(pd.util.hash_pandas_object(X, index=False).values.tobytes())
+    digest.update(repr([(col, str(dtype)) for col, dtype in X.dtypes.items()]).encode())
+    return digest.hexdigest()
+
+
+def _score_features(X, y, model, metric, features, n_splits):
+    scores, _ = create_model(X[features], y, model, metric, n_splits=n_splits)
+    return scores
+
+
+def _try_score_features(X, y, model, metric, features, n_splits):
+    # NaN when the rows cannot be scored, for instance when a fold has one class
+    try:
+        return np.mean(_score_features(X, y, model, metric, features, n_splits))
+    except (ValueError, IndexError):
+        return np.nan
+
+
+def _find_merges(n_vertices, edges):
+    '''The positions in ``edges`` of the edges which merge two components.
+    '''
+    # Chunked so that edges inside a component are skipped in bulk
+    stops = list(range(n_vertices, len(edges), max(n_vertices, 1)))
+    _, merges = _merge_components(n_vertices, edges, stops + [len(edges)],
+                                  record_labels=False)
+    return merges
+
+
+def _replay_merges(n_vertices, merge_edges):
+    '''Label every vertex by the smallest vertex of its component
+    in the graph made of ``merge_edges``.
+    '''
+    graph = coo_matrix((np.ones(len(merge_edges)), (merge_edges[:, 0], merge_edges[:, 1])),
+                       shape=(n_vertices, n_vertices))
+    _, components = connected_components(graph, directed=False)
+    _, first = np.unique(components, return_index=True)
+    return first[components].astype(np.int32)
+
+
+def _find_root(parent, vertex):
+    while parent[vertex] != vertex:
+        parent[vertex] = parent[parent[vertex]]
+        vertex = parent[vertex]
+    return vertex
+
+
+def _flatten(parent):
+    '''Point every vertex directly at its root.
+    '''
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return grandparent
+        parent = grandparent
+
+
+def _draw_representatives(labels, rng):
+    '''Relabel components by a uniformly random member of each.
+
+    Args:
+        labels (np.array): The component label of every vertex.
+        rng (np.random.RandomState): The random state to draw with.
+    '''
+    order = rng.permutation(len(labels))
+    # The first vertex of each component in a random order is its new key
+    old_keys, first = np.unique(labels[order], return_index=True)
+    new_keys = np.empty(len(labels), dtype=labels.dtype)
+    new_keys[old_keys] = order[first]
+    return new_keys[labels]
+
+
+def _labels_to_graph(labels):
+    '''Make a graph dictionary from component labels.
+    '''
+    graph = defaultdict(set)
+    for vertex, label in enumerate(labels.tolist()):
+        graph[label].add(vertex)
+    return graph
 
 
 def find_connected_components(vertices, edges):
@@ -313,24 +1833,280 @@ def find_connected_components(vertices, edges):
         d[edge[0]].add(edge[1])
         d[edge[1]].add(edge[0])
     out = defaultdict(set)
-    visited_list = []
+    visited = set()
     temp_list = []
     for vertex in vertices:
-        if vertex not in visited_list:
+        if vertex not in visited:
             temp_list.extend([x for x in d[vertex]])
-            visited_list.append(vertex)
+            visited.add(vertex)
             out[vertex].add(vertex)
             while temp_list != []:
                 newv = temp_list.pop()
-                if newv in visited_list:
+                if newv in visited:
                     pass
                 else:
                     temp_list.extend([x for x in d[newv]])
                     out[vertex].add(newv)
-                    visited_list.append(newv)
+                    visited.add(newv)
     return out
 
 
 def _one_minus_corr(a, b):
     "returns the absolute value of the correlation between a and b"
     return 1 - np.abs(np.corrcoef(a, b, rowvar=False)[0][1])
+
+
+def _standardize(data):
+    '''Center every column and scale it to unit norm.
+    Constant columns become columns of NaN.
+    '''
+    values = np.asarray(data, dtype=float)
+    centered = values - values.mean(axis=0)
+    # Rounding in the mean can leave a constant column slightly off zero
+    centered[:, values.max(axis=0) == values.min(axis=0)] = 0
+    norms = np.sqrt((centered ** 2).sum(axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return centered / norms
+
+
+def _one_minus_corr_matrix(a, b):
+    '''Vectorized ``_one_minus_corr`` for every pair of columns in a and b.
+    The correlations come from a single product of standardized matrices.
+    '''
+    z_a = _standardize(a)
+    z_b = z_a if b is a else _standardize(b)
+    with np.errstate(invalid='ignore'):
+        corr = np.clip(z_a.T.dot(z_b), -1, 1)
+    if b is a:
+        corr = (corr + corr.T) / 2
+        np.fill_diagonal(corr, np.where(np.isnan(np.diag(corr)), np.nan, 1))
+    return 1 - np.abs(corr)
+
+
+def _one_minus_pairwise_corr(a, b):
+    "returns one minus the absolute correlation of a and b where both are present"
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    both = ~np.isnan(a) & ~np.isnan(b)
+    return _one_minus_corr(a[both], b[both])
+
+
+def _complete_moments(values):
+    '''Shift and scale the present values of every column so that the
+    pairwise sums stay well conditioned, and zero the missing values.
+
+    Returns:
+        values, mask (np.array, np.array): The prepared values and a float
+            mask which is 1 where a value is present.
+    '''
+    mask = ~np.isnan(values)
+    count = np.maximum(mask.sum(axis=0), 1)
+    present = np.where(mask, values, 0)
+    center = present.sum(axis=0) / count
+    scale = np.sqrt((np.where(mask, values - center, 0) ** 2).sum(axis=0) / count)
+    scale[scale == 0] = 1
+    return np.where(mask, (values - center) / scale, 0), mask.astype(float)
+
+
+def _one_minus_pairwise_corr_matrix(a, b):
+    '''Vectorized ``_one_minus_pairwise_corr`` for every pair of columns in a and b.
+    The count, sums and sums of squares over the rows where both columns are
+    present are products of the values with mask matrices.
+    Without missing values this is ``_one_minus_corr_matrix``.
+    '''
+    values_a = np.asarray(a, dtype=float)
+    values_b = values_a if b is a else np.asarray(b, dtype=float)
+    if not (np.isnan(values_a).any() or np.isnan(values_b).any()):
+        return _one_minus_corr_matrix(a, b)
+    x_a, m_a = _complete_moments(values_a)
+    x_b, m_b = (x_a, m_a) if b is a else _complete_moments(values_b)
+
+    n = m_a.T.dot(m_b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sum_a = x_a.T.dot(m_b)
+        sum_b = sum_a.T if b is a else m_a.T.dot(x_b)
+        cov = x_a.T.dot(x_b) - sum_a * sum_b / n
+        var_a = (x_a ** 2).T.dot(m_b) - sum_a ** 2 / n
+        var_b = var_a.T if b is a else m_a.T.dot(x_b ** 2) - sum_b ** 2 / n
+        corr = np.clip(cov / np.sqrt(var_a * var_b), -1, 1)
+    # Columns which are constant where both are present have no correlation
+    corr[(n < 2) | (var_a <= 1e-10 * n) | (var_b <= 1e-10 * n)] = np.nan
+    if b is a:
+        corr = (corr + corr.T) / 2
+        np.fill_diagonal(corr, np.where(np.isnan(np.diag(corr)), np.nan, 1))
+    return 1 - np.abs(corr)
+
+
+def _one_minus_cramers_v(a, b):
+    "returns one minus Cramer's V between the categories of a and b"
+    return _one_minus_cramers_v_matrix(pd.DataFrame(a), pd.DataFrame(b))[0, 0]
+
+
+def _one_minus_mutual_info(a, b):
+    "returns one minus the normalized mutual information of a and b"
+    return _one_minus_mutual_info_matrix(pd.DataFrame(a), pd.DataFrame(b))[0, 0]
+
+
+def _categorical_codes(data, n_bins=10):
+    '''Factorize every column of a dataframe into integer codes.
+    Numeric columns with more than ``n_bins`` values are cut into
+    ``n_bins`` quantiles first and missing values are a category of their own.
+
+    Returns:
+        codes, n_categories (np.array, np.array): An int64 array of the codes
+            of every column and the number of categories of every column.
+    '''
+    codes = np.empty(data.shape, dtype=np.int64)
+    n_categories = np.empty(data.shape[1], dtype=np.int64)
+    for i in range(data.shape[1]):
+        column = data.iloc[:, i]
+        if (column.dtype.kind in 'iuf' and column.nunique() > n_bins):
+            column = pd.qcut(column, n_bins, labels=False, duplicates='drop')
+        column_codes, uniques = pd.factorize(column)
+        n_categories[i] = len(uniques) + (column_codes < 0).any()
+        codes[:, i] = np.where(column_codes < 0, len(uniques), column_codes)
+    return codes, n_categories
+
+
+class _Codes(object):
+    '''The categorical codes of some columns, as made by ``_categorical_codes``,
+    which the categorical matrix pairings take in place of a dataframe.
+    '''
+
+    def __init__(self, codes, n_categories):
+        self.codes = codes
+        self.n_categories = n_categories
+
+    def columns_at(self, index):
+        return _Codes(self.codes[:, index], self.n_categories[index])
+
+
+def _tile_columns(data, index):
+    if isinstance(data, _Codes):
+        return data.columns_at(index)
+    return data.iloc[:, index]
+
+
+def _as_codes(data):
+    if isinstance(data, _Codes):
+        return data.codes, data.n_categories
+    return _categorical_codes(data)
+
+
+def _contingency_sums(a, b, cell_func):
+    '''Sum ``cell_func`` over the nonzero cells of the contingency table
+    of every column of a with every column of b. The tables of one column of
+    a with all of b are counted by a single ``np.bincount`` of combined codes.
+
+    Args:
+        a (pd.DataFrame or _Codes): The columns of the rows of the result.
+        b (pd.DataFrame or _Codes): The columns of the columns of the result.
+        cell_func (func): Takes the counts, row totals and column totals of
+            cells and the number of rows and returns a value for every cell.
+
+    Returns:
+        sums, (codes_a, k_a), (codes_b, k_b): An array of shape
+            (a.shape[1], b.shape[1]) and the categorical codes of a and b.
+    '''
+    codes_a, k_a = _as_codes(a)
+    codes_b, k_b = (codes_a, k_a) if b is a else _as_codes(b)
+    n_rows = len(codes_a)
+    # Give every category of every column of b its own index
+    n_b = k_b.sum()
+    b_offsets = np.concatenate(([0], np.cumsum(k_b)[:-1])).astype(np.int64)
+    global_b = codes_b + b_offsets
+    owner = np.repeat(np.arange(len(k_b)), k_b)
+    col_totals = np.bincount(global_b.ravel(), minlength=n_b).astype(float)
+
+    sums = np.zeros((len(k_a), len(k_b)))
+    for i in range(len(k_a)):
+        # Pairings are symmetric, so with b is a only j >= i is counted
+        first = i if b is a else 0
+        combined = (codes_a[:, i, None] * n_b + global_b[:, first:]).ravel()
+        n_cells = k_a[i] * n_b
+        if n_cells <= 4 * len(combined):
+            tables = np.bincount(combined, minlength=n_cells).reshape(k_a[i], n_b)
+            rows, cells = np.nonzero(tables)
+            counts = tables[rows, cells]
+        else:
+            # Tables of many categories are mostly empty
+            flat, counts = np.unique(combined, return_counts=True)
+            rows, cells = np.divmod(flat, n_b)
+        row_totals = np.bincount(codes_a[:, i], minlength=k_a[i]).astype(float)
+        values = cell_func(counts.astype(float), row_totals[rows], col_totals[cells], n_rows)
+        sums[i] = np.bincount(owner[cells], weights=values, minlength=len(k_b))
+    if b is a:
+        sums = np.triu(sums) + np.triu(sums, 1).T
+    return sums, (codes_a, k_a), (codes_b, k_b)
+
+
+def _one_minus_cramers_v_matrix(a, b):
+    '''Vectorized ``_one_minus_cramers_v`` for every pair of columns in a and b.
+    Uses chi2 / n = sum(count ** 2 / (row_total * col_total)) - 1.
+    A column with a single category has NaN everywhere.
+    '''
+    sums, (_, k_a), (_, k_b) = _contingency_sums(
+        a, b, lambda counts, rows, cols, n: counts ** 2 / (rows * cols))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cramers_v = np.sqrt(np.clip(sums - 1, 0, None) /
+                            (np.minimum.outer(k_a, k_b) - 1))
+    cramers_v[np.minimum.outer(k_a, k_b) < 2] = np.nan
+    return 1 - np.clip(cramers_v, 0, 1)
+
+
+def _entropies(codes, n_categories):
+    entropies = np.empty(len(n_categories))
+    for i in range(len(n_categories)):
+        p = np.bincount(codes[:, i], minlength=n_categories[i]) / float(len(codes))
+        p = p[p > 0]
+        entropies[i] = -(p * np.log(p)).sum()
+    return entropies
+
+
+def _one_minus_mutual_info_matrix(a, b):
+    '''Vectorized ``_one_minus_mutual_info`` for every pair of columns in a and b.
+    The mutual information is normalized by the mean of the two entropies.
+    A column with a single category has NaN everywhere.
+    '''
+    mutual_info, (codes_a, k_a), (codes_b, k_b) = _contingency_sums(
+        a, b, lambda counts, rows, cols, n: counts / n * np.log(counts * n / (rows * cols)))
+    h_a = _entropies(codes_a, k_a)
+    h_b = h_a if b is a else _entropies(codes_b, k_b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nmi = mutual_info / np.add.outer(h_a, h_b) * 2
+    nmi[np.minimum.outer(k_a, k_b) < 2] = np.nan
+    return 1 - np.clip(nmi, 0, 1)
+
+
+# The fewest rows per fold RandomSelect scores a round of its search on
+_MIN_FOLD_ROWS = 20
+
+# The number of pairs adj_maker evaluates at once with a pairing function
+_PAIRS_PER_BLOCK = 10 ** 6
+
+# The default tile size of a memory mapped adjacency graph
+_MMAP_TILE_SIZE = 1024
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+_MATRIX_PAIRINGS = {_one_minus_corr: _one_minus_corr_matrix,
+                    _one_minus_pairwise_corr: _one_minus_pairwise_corr_matrix,
+                    _one_minus_cramers_v: _one_minus_cramers_v_matrix,
+                    _one_minus_mutual_info: _one_minus_mutual_info_matrix}
+
+# Matrix pairings which take the codes of _categorical_codes
+_CATEGORICAL_PAIRINGS = (_one_minus_cramers_v, _one_minus_mutual_info)
+
+# Pairing functions which can be given by name
+_NAMED_PAIRINGS = {'correlation': _one_minus_corr,
+                   'pairwise_correlation': _one_minus_pairwise_corr,
+                   'cramers_v': _one_minus_cramers_v,
+                   'mutual_info': _one_minus_mutual_info}
+
+
+def _pairing_name(pairing_func):
+    '''The name of a built in pairing, or None for any other function.
+    '''
+    for name, func in _NAMED_PAIRINGS.items():
+        if func is pairing_func:
+            return name
+    return None
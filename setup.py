@@ -14,6 +14,7 @@ requirements = ['ipython>=5.4',
                 'numpy>=1.13.3',
                 'scipy>=1.0.0',
                 'scikit-learn>=0.19.1',
+                'joblib>=0.12',
                 'pandas>=0.20.3',
 
                 'bokeh>=0.12.16',
@@ -2,12 +2,18 @@
 # -*- coding: utf-8 -*-
 
 """Tests for `learning` module"""
+import functools
+
+import numpy as np
 import pandas as pd
 import pytest
 
 import henchman.learning as learning
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import f1_score, roc_auc_score
+from sklearn.cluster import KMeans
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.metrics import accuracy_score, f1_score, fbeta_score, log_loss, roc_auc_score
+from sklearn.neighbors import KNeighborsClassifier
 
 
 @pytest.fixture
@@ -31,6 +37,15 @@ def test_create_holdout(Xy):
     assert X.shape[1] == X_ho.shape[1]
 
 
+def test_create_holdout_copies(Xy):
+    X, y = Xy
+    X_tr, X_ho, y_tr, y_ho = learning.create_holdout(X, y)
+    X_tr.iloc[0, 0] = -1
+    X_ho.iloc[0, 0] = -1
+    assert X.iloc[0, 0] != -1
+    assert X.iloc[len(X_tr), 0] != -1
+
+
 def test_create_model(Xy):
     X, y = Xy
     score1, _ = learning.create_model(X.iloc[:, :3], y, RandomForestClassifier(), f1_score)
@@ -40,6 +55,170 @@ def test_create_model(Xy):
     assert len(score2) == 3
 
 
+def test_create_model_n_jobs(Xy):
+    X, y = Xy
+    model = RandomForestClassifier(n_estimators=10, random_state=0)
+    scores, fit_model = learning.create_model(X.iloc[:, :3], y, model,
+                                              roc_auc_score, n_splits=3)
+    parallel_scores, models = learning.create_model(X.iloc[:, :3], y, model,
+                                                    roc_auc_score, n_splits=3,
+                                                    n_jobs=2, return_models=True)
+    assert parallel_scores == scores
+    assert len(models) == 3
+    assert len(set(map(id, models))) == 3
+    assert model not in models
+    thread_scores, _ = learning.create_model(X.iloc[:, :3], y, model, roc_auc_score,
+                                             n_splits=3, n_jobs=2, backend='threading')
+    assert thread_scores == scores
+
+
+def test_create_model_as_array(Xy):
+    X, y = Xy
+    X = X.iloc[:, :3]
+    model = RandomForestClassifier(n_estimators=10, random_state=0)
+    for n_splits in [1, 3]:
+        scores, _ = learning.create_model(X, y, model, roc_auc_score, n_splits=n_splits)
+        array_scores, _ = learning.create_model(X, y, model, roc_auc_score,
+                                                n_splits=n_splits, as_array=True)
+        assert array_scores == scores
+
+    X_train, X_test, y_train, y_test = learning.create_holdout(X, y, copy=False)
+    assert np.shares_memory(y_train.values, y.values)
+    assert len(X_train) == 70 and len(X_test) == 30
+    assert learning._as_slice(np.arange(3, 8)) == slice(3, 8)
+
+
+def test_create_model_cache(Xy, tmpdir):
+    X, y = Xy
+    X = X.iloc[:, :3]
+    path = str(tmpdir.join('cache'))
+    learning.set_cache(path)
+    try:
+        model = RandomForestClassifier(n_estimators=10, random_state=0)
+        scores, fit_model = learning.create_model(X, y, model, roc_auc_score, n_splits=2)
+        cached_scores, cached_model = learning.create_model(
+            X, y, RandomForestClassifier(n_estimators=10, random_state=0),
+            roc_auc_score, n_splits=2)
+        assert cached_scores == scores
+        assert cached_model is not fit_model
+        assert hasattr(cached_model, 'estimators_')
+        assert len(tmpdir.join('cache').listdir()) == 1
+
+        learning.create_model(X, y, model.set_params(n_estimators=5), roc_auc_score)
+        assert len(tmpdir.join('cache').listdir()) == 2
+        learning.set_cache(path, max_bytes=1)
+        learning.create_model(X, y, model, f1_score)
+        assert len(tmpdir.join('cache').listdir()) == 1
+
+        # Metrics with the same name but different code are cached apart
+        scores, _ = learning.create_model(X, y, model, lambda y_true, preds: 1.0)
+        assert scores == [1.0]
+        scores, _ = learning.create_model(X, y, model, lambda y_true, preds: 2.0)
+        assert scores == [2.0]
+
+        # Large array parameters are told apart by every entry
+        init = np.zeros((1000, 2))
+        other_init = init.copy()
+        other_init[500, 1] = 1
+        metrics = learning._metric_dict(f1_score)
+        keys = [learning._cache_key(X, y, KMeans(n_clusters=1000, init=array), metrics,
+                                    1, .3, False, False, False)
+                for array in (init, other_init)]
+        assert keys[0] != keys[1]
+    finally:
+        learning.set_cache(None)
+
+
+def test_create_model_incremental(Xy):
+    X, y = Xy
+    X = X.iloc[:, 1:4]
+    X = ((X - X.mean()) / X.std()).fillna(0)
+    scores, models = learning.create_model(X, y, SGDClassifier(random_state=0), f1_score,
+                                           n_splits=3, incremental=True,
+                                           return_models=True)
+    assert len(scores) == 3
+    assert len(models) == 3
+
+    model = GradientBoostingClassifier(n_estimators=10, random_state=0)
+    scores, fit_model = learning.create_model(X, y, model, roc_auc_score,
+                                              n_splits=3, incremental=True)
+    assert len(scores) == 3
+    assert fit_model.n_estimators == 30
+    assert model.n_estimators == 10
+
+    for model in (KNeighborsClassifier(), LogisticRegression()):
+        with pytest.raises(AssertionError):
+            learning.create_model(X, y, model, f1_score, n_splits=3, incremental=True)
+
+
+def test_create_model_incremental_hist(Xy):
+    try:
+        from sklearn.ensemble import HistGradientBoostingClassifier
+    except ImportError:
+        try:
+            # Experimental in scikit-learn 0.21 to 0.23
+            from sklearn.experimental import enable_hist_gradient_boosting  # noqa: F401
+            from sklearn.ensemble import HistGradientBoostingClassifier
+        except ImportError:
+            pytest.skip('HistGradientBoostingClassifier needs scikit-learn 0.21')
+    X, y = Xy
+    X = X.iloc[:, 1:4]
+
+    # Every fold adds iterations to the last fold's model
+    model = HistGradientBoostingClassifier(max_iter=5, random_state=0)
+    if 'early_stopping' in model.get_params():
+        model.set_params(early_stopping=False)
+    scores, models = learning.create_model(X, y, model, roc_auc_score, n_splits=3,
+                                           incremental=True, return_models=True)
+    assert [fit.n_iter_ for fit in models] == [5, 10, 15]
+
+
+class CountingForest(RandomForestClassifier):
+    calls = {'predict': 0, 'predict_proba': 0}
+
+    def predict(self, X):
+        CountingForest.calls['predict'] += 1
+        # Forests predict through predict_proba, which is not counted here
+        n_proba = CountingForest.calls['predict_proba']
+        preds = super(CountingForest, self).predict(X)
+        CountingForest.calls['predict_proba'] = n_proba
+        return preds
+
+    def predict_proba(self, X):
+        CountingForest.calls['predict_proba'] += 1
+        return super(CountingForest, self).predict_proba(X)
+
+
+def test_create_model_metrics(Xy):
+    X, y = Xy
+    X = X.iloc[:, :3]
+    metrics = [roc_auc_score, log_loss, accuracy_score, f1_score]
+    scores, _ = learning.create_model(X, y, CountingForest(random_state=0), metrics,
+                                      n_splits=3)
+    # Every prediction is made once per fold, whatever the number of metrics
+    assert CountingForest.calls == {'predict': 3, 'predict_proba': 3}
+    assert list(scores) == ['roc_auc_score', 'log_loss', 'accuracy_score', 'f1_score']
+    for metric in metrics:
+        single, _ = learning.create_model(X, y, RandomForestClassifier(random_state=0),
+                                          metric, n_splits=3)
+        assert np.allclose(scores[metric.__name__], single)
+
+    named, _ = learning.create_model(X, y, RandomForestClassifier(random_state=0),
+                                     {'auc': roc_auc_score}, n_splits=3)
+    assert np.allclose(named['auc'], scores['roc_auc_score'])
+
+    # Partials have no name, so they are registered by their key
+    f2 = functools.partial(fbeta_score, beta=2)
+    partials, _ = learning.create_model(X, y, RandomForestClassifier(random_state=0),
+                                        {'f2': f2, 'auc': functools.partial(roc_auc_score)},
+                                        n_splits=3)
+    assert np.allclose(partials['auc'], scores['roc_auc_score'])
+    learning.register_metric('f2', 'predict')
+    single, _ = learning.create_model(X, y, RandomForestClassifier(random_state=0), f2,
+                                      n_splits=3)
+    assert np.allclose(partials['f2'], single)
+
+
 def test_return_df_shape(Xy):
     X, y = Xy
     out1 = learning.create_model(X.iloc[:, :3], y, RandomForestClassifier(),
@@ -9,8 +9,14 @@ import pytest
 import henchman.selection as selection
 
 from henchman.plotting import dendrogram, show
+from scipy.stats import chi2_contingency
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, normalized_mutual_info_score, roc_auc_score
+from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
 
 
 @pytest.fixture(scope="module")
@@ -38,6 +44,54 @@ def test_randomselect(Xy):
     assert feats.shape[1] == 10
 
 
+def test_randomselect_search(Xy):
+    X, y = Xy
+    model = RandomForestClassifier(n_estimators=5, random_state=0)
+    selector = selection.RandomSelect(n_feats=10, model=model, metric=accuracy_score,
+                                      n_subsets=9, min_fraction=.4, eta=3, n_jobs=2,
+                                      random_state=0)
+    selector.fit(X, y)
+    scores = selector.search_scores
+
+    assert selector.transform(X).shape[1] == 10
+    assert list(scores.groupby('rung').size()) == [9, 3]
+    assert list(scores.groupby('rung').n_rows.first()) == [40, 100]
+    final = scores[scores.rung == 1]
+    assert final.score.max() == final.score[final.names.apply(selector.names.__eq__)].iloc[0]
+    other = selection.RandomSelect(n_feats=10, model=model, metric=accuracy_score,
+                                   n_subsets=9, min_fraction=.4, random_state=0).fit(X, y)
+    assert other.names == selector.names
+
+    # Small rounds are given more rows, and folds with one class are ranked last
+    small = selection.RandomSelect(n_feats=10, model=model, metric=roc_auc_score,
+                                   n_subsets=9, min_fraction=.05, n_splits=3,
+                                   random_state=0).fit(X, y)
+    assert small.search_scores.n_rows.min() == 80
+    assert np.isnan(selection._try_score_features(X.iloc[:20], y.iloc[:20] * 0, model,
+                                                  roc_auc_score, small.names, 1))
+
+
+def test_sequentialselect(Xy, fit_dend):
+    X, y = Xy
+    model = RandomForestClassifier(n_estimators=5, random_state=0)
+    forward = selection.SequentialSelect(n_feats=3, model=model, metric=accuracy_score,
+                                         drop_fraction=.5, dendrogram=fit_dend,
+                                         pool_size=100, n_jobs=2).fit(X, y)
+
+    assert forward.transform(X).shape[1] == 3
+    assert list(forward.path.n_features) == [1, 2, 3]
+    assert set(forward.names) <= set(fit_dend.features_at_step(
+        fit_dend.find_set_of_size(100)))
+    assert forward.path.feature.tolist() == forward.names
+
+    backward = selection.SequentialSelect(n_feats=5, model=model, metric=accuracy_score,
+                                          direction='backward', drop_fraction=.5)
+    backward.fit(X.iloc[:, :12], y)
+    assert len(backward.names) == 5
+    assert list(backward.path.n_features)[-1] == 5
+    assert clone(backward).get_params()['direction'] == 'backward'
+
+
 def test_dend_fit(fit_dend):
     selector = fit_dend
     assert selector.adj is not None
@@ -59,7 +113,7 @@ def test_dend_features_at_step(fit_dend):
 
 
 def test_dend_find_set_of_size(fit_dend, capsys):
-    assert fit_dend.find_set_of_size(80) == 6
+    assert fit_dend.find_set_of_size(80) == 5
 
 
 def test_dend_score_at_point(Xy, fit_dend):
@@ -105,7 +159,7 @@ def test_dend_plot(fit_dend):
 
 def test_build_edges(capsys):
     fake_sel = selection.Dendrogram()
-    fake_sel.adj = np.asarray(range(501))
+    fake_sel.adj = np.arange(529, dtype=float).reshape(23, 23)
     fake_sel._build_edges(None)
 
     output, _ = capsys.readouterr()
@@ -117,13 +171,458 @@ def test_build_edges(capsys):
     assert split_output[1] == real_line_2
 
 
+def test_build_edges_prefix():
+    fake_sel = selection.Dendrogram()
+    fake_sel.adj = np.array([[0., .2, .5],
+                             [.2, 0., np.nan],
+                             [.4, np.nan, 0.]])
+    fake_sel._build_edges(None)
+
+    assert fake_sel.threshlist == [0., .2, .4, .5]
+    assert [len(edges) for edges in fake_sel.edges] == [0, 1, 2, 2]
+    assert fake_sel.edges[2].tolist() == [[0, 1], [0, 2]]
+
+
 def test_build_graphs_exit():
     fake_sel = selection.Dendrogram()
     fake_sel.threshlist = [1, 2]
-    fake_sel.edges = [[(0, 1)], [(1, 2), (0, 1)]]
-    fake_sel.graphs = [{0: {0, 1}, 2: {2}}, {0: {0, 1, 2}}]
+    fake_sel.edges = selection._EdgeSteps(np.array([(0, 1), (1, 2)]), [1, 2])
+    fake_sel.graphs = selection._GraphSteps(np.array([[0, 0, 2], [0, 0, 0]]))
     fake_sel._build_graphs()
 
     assert fake_sel.threshlist == [1]
     assert fake_sel.edges[0][0][0] == 0
     assert fake_sel.graphs[0][2] == {2}
+
+
+def test_adj_maker_matrix_pairing(Xy):
+    X, y = Xy
+    X = X.iloc[:, :20]
+    adj_fast, columns = selection.adj_maker(X, selection._one_minus_corr)
+    adj_slow, _ = selection.adj_maker(X, lambda a, b: selection._one_minus_corr(a, b))
+
+    assert columns == {i: col for i, col in enumerate(X)}
+    assert np.array_equal(np.isnan(adj_fast), np.isnan(adj_slow))
+    assert np.nanmax(np.abs(adj_fast - adj_slow)) < 1e-10
+
+
+def test_adj_maker_symmetric_n_jobs(Xy):
+    X, y = Xy
+    X = X.iloc[:, :12]
+    pairing = lambda a, b: selection._one_minus_corr(a, b)  # noqa: E731
+    adj_full, _ = selection.adj_maker(X, pairing)
+    adj_sym, _ = selection.adj_maker(X, pairing, symmetric=True, n_jobs=2)
+    adj_par, _ = selection.adj_maker(X, pairing, n_jobs=2)
+
+    off_diag = ~np.eye(12, dtype=bool)
+    assert np.all(np.diag(adj_sym) == 0)
+    assert np.allclose(adj_sym[off_diag], adj_full[off_diag], equal_nan=True)
+    assert np.allclose(adj_par, adj_full, equal_nan=True)
+
+    # Step 0 has every column, as it does without symmetric
+    X = X.iloc[:, 1:9]
+    sym_dend = selection.Dendrogram(X, pairing, symmetric=True)
+    full_dend = selection.Dendrogram(X, pairing)
+    assert sym_dend.graphs.n_components[0] == full_dend.graphs.n_components[0] == 8
+    assert len(sym_dend.features_at_step(sym_dend.find_set_of_size(8))) == 8
+
+
+def test_merge_components():
+    edges = np.array([[2, 3], [0, 1], [1, 2], [0, 3], [4, 5]])
+    labels, merges = selection._merge_components(6, edges, [1, 3, 5])
+
+    assert labels.dtype == np.int32
+    assert labels[0].tolist() == [0, 1, 2, 2, 4, 5]
+    assert labels[1].tolist() == [0, 0, 0, 0, 4, 5]
+    assert labels[2].tolist() == [0, 0, 0, 0, 4, 4]
+    assert merges.tolist() == [0, 1, 2, 4]
+
+    graph = selection._labels_to_graph(labels[1])
+    expected = selection.find_connected_components(range(6), edges[:3])
+    assert dict(graph) == dict(expected)
+
+
+def test_draw_representatives():
+    labels = np.array([0, 0, 2, 0, 2, 5], dtype=np.int32)
+    new_labels = selection._draw_representatives(labels, np.random.RandomState(0))
+
+    for old_key in [0, 2, 5]:
+        members = labels == old_key
+        new_key = new_labels[members][0]
+        assert np.all(new_labels[members] == new_key)
+        assert labels[new_key] == old_key
+
+
+def test_dend_merge_tree(Xy, fit_dend):
+    X, y = Xy
+    merge_dend = selection.Dendrogram(X, method='merge_tree')
+    n_components = merge_dend.graphs.n_components
+
+    assert np.all(np.diff(n_components) == -1)
+    for size in [300, 100, 80, 79]:
+        step = merge_dend.find_set_of_size(size)
+        assert len(merge_dend.features_at_step(step)) == size
+
+    # A thresh step is the merge step with the same number of components
+    size = len(fit_dend.features_at_step(10))
+    step = merge_dend.find_set_of_size(size)
+    partition = {frozenset(members) for members in merge_dend.graphs[step].values()}
+    assert partition == {frozenset(members) for members in fit_dend.graphs[10].values()}
+
+    merge_dend.shuffle_all_representatives()
+    assert len(merge_dend.features_at_step(step)) == size
+
+
+def test_dend_lazy(Xy):
+    X, y = Xy
+    eager_dend = selection.Dendrogram(X, max_threshes=50)
+    lazy_dend = selection.Dendrogram(X, max_threshes=50, lazy=True, cache_size=2)
+
+    assert lazy_dend.threshlist == eager_dend.threshlist
+    assert np.array_equal(lazy_dend.graphs.n_components, eager_dend.graphs.n_components)
+    assert len(lazy_dend.graphs._cache) == 0
+    for step in [0, 10, len(lazy_dend.graphs) - 1]:
+        assert np.array_equal(lazy_dend.graphs.labels_at(step),
+                              eager_dend.graphs.labels_at(step))
+    assert list(lazy_dend.graphs._cache) == [10, len(lazy_dend.graphs) - 1]
+    assert lazy_dend.find_set_of_size(80) == eager_dend.find_set_of_size(80)
+    assert lazy_dend.features_at_step(48) == eager_dend.features_at_step(48)
+
+
+def test_dend_representative_stability(Xy, fit_dend):
+    X, y = Xy
+    labels = fit_dend.graphs.labels_at(10).copy()
+    model = RandomForestClassifier(n_estimators=5, random_state=0)
+    scores = fit_dend.representative_stability(X, y, model, accuracy_score, step=10,
+                                               n_draws=4, random_state=0)
+
+    assert scores.shape == (4,)
+    assert np.all((scores >= 0) & (scores <= 1))
+    assert np.array_equal(fit_dend.graphs.labels_at(10), labels)
+    parallel_scores = fit_dend.representative_stability(X, y, model, accuracy_score,
+                                                        step=10, n_draws=4, n_jobs=2,
+                                                        random_state=0)
+    assert np.allclose(scores, parallel_scores)
+
+
+def test_dend_score_path(Xy, fit_dend):
+    X, y = Xy
+    model = RandomForestClassifier(n_estimators=5, random_state=0)
+    path = fit_dend.score_path(X, y, model, accuracy_score, steps=[0, 10, 40],
+                               n_splits=2, n_jobs=2)
+
+    assert list(path.columns) == ['step', 'thresh', 'n_features', 'split', 'score']
+    assert list(path.step) == [0, 0, 10, 10, 40, 40]
+    assert list(path.split) == [0, 1] * 3
+    assert path.n_features.iloc[2] == len(fit_dend.features_at_step(10))
+    assert path.thresh.iloc[4] == fit_dend.threshlist[40]
+
+
+def test_dend_sklearn(Xy):
+    X, y = Xy
+    dend = selection.Dendrogram(max_threshes=40, n_feats=80).fit(X, y)
+    params = dend.get_params()
+    assert params['n_feats'] == 80
+    assert 'X' not in params
+
+    # The fit cache is off unless turned on
+    assert clone(dend).fit(X, y).adj is not dend.adj
+    with pytest.raises(AssertionError):
+        selection.Dendrogram(max_threshes=40).fit(X, np.corrcoef)
+
+    selection.set_fit_cache()
+    try:
+        # Refitting the same data with another n_feats reuses the fitted graphs
+        dend = selection.Dendrogram(max_threshes=40, n_feats=80).fit(X, y)
+        other = clone(dend).set_params(n_feats=100).fit(X, y)
+        assert other.adj is dend.adj
+        assert other.transform(X).shape[1] >= dend.transform(X).shape[1]
+        assert selection.Dendrogram(max_threshes=30).fit(X).adj is not dend.adj
+
+        # Every fold of a search is kept, however many folds there are
+        pipe = Pipeline([('dend', selection.Dendrogram(max_threshes=40)),
+                         ('model', RandomForestClassifier(n_estimators=5, random_state=0))])
+        search = GridSearchCV(pipe, {'dend__n_feats': [80, 100]}, cv=5)
+        search.fit(X, y)
+        assert search.best_params_['dend__n_feats'] in (80, 100)
+        assert len(selection._FIT_CACHE['fits']) == 7
+
+        # Dropped once they no longer fit
+        selection.set_fit_cache(selection._FIT_CACHE['nbytes'] // 2)
+        assert len(selection._FIT_CACHE['fits']) < 7
+    finally:
+        selection.set_fit_cache(None)
+
+    # Steps before the Dendrogram may hand it an array
+    X_num = X.iloc[:, :40].astype(float).fillna(0)
+    pipe = Pipeline([('scale', StandardScaler()),
+                     ('dend', selection.Dendrogram(max_threshes=20, n_feats=5)),
+                     ('model', LogisticRegression())])
+    pipe.fit(X_num, y)
+    assert pipe.named_steps['dend'].transform(X_num.values).shape[1] >= 5
+    assert len(pipe.named_steps['dend'].columns) == 40
+    assert len(pipe.predict(X_num)) == len(y)
+
+
+def test_pairwise_correlation(Xy):
+    X, y = Xy
+    X = X.iloc[:, :60].astype(float)
+    X_nan = X.mask(np.random.RandomState(0).rand(*X.shape) < .2)
+    adj, _ = selection.adj_maker(X_nan, 'pairwise_correlation')
+    dense_adj, _ = selection.adj_maker(X_nan, selection._one_minus_corr)
+
+    assert np.isnan(dense_adj).sum() > np.isnan(adj).sum()
+    for i, j in [(0, 1), (0, 2), (1, 40), (5, 40)]:
+        expected = selection._one_minus_pairwise_corr(X_nan.iloc[:, i], X_nan.iloc[:, j])
+        assert np.isclose(adj[i, j], expected, equal_nan=True)
+    assert np.allclose(selection.adj_maker(X, 'pairwise_correlation')[0],
+                       selection.adj_maker(X, selection._one_minus_corr)[0], equal_nan=True)
+    block = selection._one_minus_pairwise_corr_matrix(X_nan.iloc[:, :20], X_nan.iloc[:, 20:])
+    assert np.allclose(block, adj[:20, 20:], equal_nan=True)
+
+
+def test_categorical_pairings(monkeypatch):
+    rng = np.random.RandomState(0)
+    a = rng.randint(0, 4, 300)
+    X = pd.DataFrame({'a': a.astype(str),
+                      'b': np.where(rng.rand(300) < .8, a, rng.randint(0, 3, 300)),
+                      'c': rng.randn(300) + a,
+                      'd': ['x'] * 300,
+                      'e': np.where(rng.rand(300) < .1, None, rng.choice(list('pqr'), 300))})
+    codes, _ = selection._categorical_codes(X)
+    table = pd.crosstab(codes[:, 0], codes[:, 1]).values
+    cramers_v = np.sqrt(chi2_contingency(table, correction=False)[0] / 300 / 3)
+    nmi = normalized_mutual_info_score(codes[:, 0], codes[:, 2])
+
+    adj, _ = selection.adj_maker(X, 'cramers_v')
+    assert np.isclose(adj[0, 1], 1 - cramers_v)
+    assert np.allclose(adj, selection.adj_maker(X, selection._one_minus_cramers_v)[0],
+                       equal_nan=True)
+    assert np.all(np.isnan(adj[3]))
+    full_adj, _ = selection.adj_maker(X, 'mutual_info')
+
+    # Tiles are sliced from codes made once for every column
+    calls = []
+    categorical_codes = selection._categorical_codes
+    monkeypatch.setattr(selection, '_categorical_codes',
+                        lambda data: calls.append(data.shape) or categorical_codes(data))
+    adj, _ = selection.adj_maker(X, 'mutual_info', tile_size=2)
+    assert calls == [X.shape]
+    assert np.isclose(adj[2, 0], 1 - nmi)
+    assert np.allclose(np.diag(adj)[[0, 1, 2, 4]], 0)
+    assert np.allclose(adj, full_adj, equal_nan=True)
+
+    dend = selection.Dendrogram(X, pairing_func='cramers_v')
+    assert dend.features_at_step(0)[0] == 'a'
+
+
+def test_dend_sizes(Xy):
+    X, y = Xy
+    sizes = [300, 200, 100, 80]
+    size_dend = selection.Dendrogram(X, sizes=sizes)
+    full_dend = selection.Dendrogram(X, lazy=True)
+
+    assert len(size_dend.threshlist) == len(sizes)
+    # Ties in the weights can merge several components at once
+    assert np.all(size_dend.graphs.n_components <= sizes)
+    assert list(size_dend.graphs.n_components[1:]) == sizes[1:]
+    for step, thresh in enumerate(size_dend.threshlist):
+        full_step = full_dend.threshlist.index(thresh)
+        if full_step > 0:
+            assert full_dend.graphs.n_components[full_step - 1] > sizes[step]
+        assert np.array_equal(size_dend.graphs.labels_at(step),
+                              full_dend.graphs.labels_at(full_step))
+    assert len(size_dend.transform(X, n_feats=100).columns) == 100
+
+
+def test_dend_approximate(Xy, fit_dend):
+    X, y = Xy
+    approx_dend = selection.Dendrogram(X, approximate=True, approx_thresh=.3,
+                                       random_state=0)
+    weights = approx_dend._edge_weights
+
+    assert approx_dend.adj is None
+    assert weights.max() <= .3
+    # Every approximate edge is a real edge with the same weight
+    dense = {tuple(edge): weight for edge, weight
+             in zip(fit_dend._edge_array.tolist(), fit_dend._edge_weights)}
+    for edge, weight in zip(approx_dend._edge_array.tolist(), weights):
+        assert abs(dense[tuple(edge)] - weight) < 1e-10
+
+    step = approx_dend.find_set_of_size(200)
+    assert len(approx_dend.features_at_step(step)) <= 200
+
+
+def test_dend_approximate_uncorrelated():
+    rng = np.random.RandomState(0)
+    X = pd.DataFrame(rng.randn(500, 50))
+    approx_dend = selection.Dendrogram(X, approximate=True, random_state=0)
+    # Step 0 has every column, and no edge is ever found
+    assert list(approx_dend.graphs.n_components) == [50]
+    assert len(approx_dend.transform(X, 50).columns) == 50
+
+    # One edge makes one step past the first
+    X[1] = X[0] + .1 * rng.randn(500)
+    approx_dend = selection.Dendrogram(X, approximate=True, random_state=0)
+    assert list(approx_dend.graphs.n_components) == [50, 49]
+
+
+def test_approximate_candidates_subquadratic():
+    rng = np.random.RandomState(0)
+    n_candidates = []
+    for n_cols in (1000, 4000):
+        band_bits, n_bands = selection._band_shape(n_cols, .3, n_bands=20)
+        # Unrelated columns get independent keys, less the flipped sign
+        keys = rng.randint(0, 2 ** (band_bits - 1), size=(n_cols, n_bands))
+        rows, cols = selection._candidate_pairs(keys)
+        assert (rows < cols).all()
+        n_candidates.append(len(rows))
+    # Four times the columns would give sixteen times the pairs
+    assert n_candidates[1] < 8 * n_candidates[0]
+
+    # A bucket holding every column is split by the next band
+    keys[:, 0] = 0
+    rows, cols = selection._candidate_pairs(keys[:, :2], max_bucket=64)
+    assert len(rows) < 4000 * 3999 // 20
+
+
+def test_adj_maker_tiles(Xy, tmpdir):
+    X, y = Xy
+    adj, _ = selection.adj_maker(X, selection._one_minus_corr)
+    adj_tiled, _ = selection.adj_maker(X, selection._one_minus_corr, symmetric=True,
+                                       tile_size=64, dtype=np.float32,
+                                       mmap_path=str(tmpdir.join('adj.dat')))
+
+    assert isinstance(adj_tiled, np.memmap)
+    assert adj_tiled.dtype == np.float32
+    assert np.allclose(adj_tiled, adj, atol=1e-6, equal_nan=True)
+
+
+def test_dend_mmap(Xy, tmpdir):
+    X, y = Xy
+    dense_dend = selection.Dendrogram(X, method='merge_tree')
+    mmap_dend = selection.Dendrogram(X, method='merge_tree', tile_size=100,
+                                     mmap_path=str(tmpdir.join('adj.dat')))
+
+    assert len(mmap_dend._edge_array) == len(dense_dend._merges)
+    assert np.allclose(mmap_dend.threshlist, dense_dend.threshlist)
+    assert np.array_equal(mmap_dend.graphs.n_components, dense_dend.graphs.n_components)
+
+    # The forest's thresholds give every number of components the dense fit has
+    dense_dend = selection.Dendrogram(X)
+    mmap_dend = selection.Dendrogram(X, mmap_path=str(tmpdir.join('thresh.dat')))
+    assert mmap_dend.graphs.n_components[0] == dense_dend.graphs.n_components[0]
+    assert np.array_equal(np.unique(mmap_dend.graphs.n_components),
+                          np.unique(dense_dend.graphs.n_components))
+    two_dend = selection.Dendrogram(X.iloc[:, :2], mmap_path=str(tmpdir.join('two.dat')))
+    assert list(two_dend.graphs.n_components) == [2]
+
+    # Only the smaller direction of a non-symmetric pairing makes an edge
+    def pairing(a, b):
+        return (1 - abs(a.corr(b))) * (2 if a.name < b.name else 1)
+
+    X = X.iloc[:, :20]
+    dense_dend = selection.Dendrogram(X, pairing, method='merge_tree')
+    mmap_dend = selection.Dendrogram(X, pairing, method='merge_tree', n_jobs=2,
+                                     mmap_path=str(tmpdir.join('custom.dat')))
+    assert np.allclose(mmap_dend.threshlist, dense_dend.threshlist)
+
+
+def test_correlation_accumulator(Xy):
+    X, y = Xy
+    adj, _ = selection.adj_maker(X, selection._one_minus_corr)
+    first = selection.CorrelationAccumulator().update(X.iloc[:30])
+    second = selection.CorrelationAccumulator().update(X.iloc[30:70]).update(X.iloc[70:])
+    first.merge(second)
+
+    assert first.count == X.shape[0]
+    assert np.allclose(first.adjacency(), adj, atol=1e-8, equal_nan=True)
+
+
+def test_dend_fit_chunks(Xy, fit_dend):
+    X, y = Xy
+    chunk_dend = selection.Dendrogram()
+    chunk_dend.fit_chunks((X.iloc[i:i + 25] for i in range(0, X.shape[0], 25)),
+                          max_threshes=50, n_jobs=2)
+
+    assert chunk_dend.columns == fit_dend.columns
+    assert len(chunk_dend.features_at_step(48)) == 79
+
+    # The Dendrogram's own parameters are used
+    chunk_dend = selection.Dendrogram(max_threshes=20)
+    chunk_dend.fit_chunks(X.iloc[i:i + 25] for i in range(0, X.shape[0], 25))
+    assert len(chunk_dend.threshlist) <= 20
+    chunk_dend = selection.Dendrogram(sizes=[200, 100]).fit_chunks(
+        X.iloc[i:i + 25] for i in range(0, X.shape[0], 25))
+    assert list(chunk_dend.graphs.n_components) == [200, 100]
+
+    with pytest.raises(AssertionError):
+        selection.Dendrogram(pairing_func='cramers_v').fit_chunks([X])
+
+
+def test_dend_save_load(Xy, fit_dend, tmpdir):
+    X, y = Xy
+    fit_dend.save(str(tmpdir.join('thresh')))
+    loaded = selection.Dendrogram.load(str(tmpdir.join('thresh')))
+
+    assert isinstance(loaded.adj, np.memmap)
+    assert loaded.columns == fit_dend.columns
+    assert loaded.threshlist == [float(thresh) for thresh in fit_dend.threshlist]
+    assert np.array_equal(loaded.edges[10], fit_dend.edges[10])
+    assert loaded.features_at_step(48) == fit_dend.features_at_step(48)
+    assert loaded.find_set_of_size(80) == fit_dend.find_set_of_size(80)
+
+    merge_dend = selection.Dendrogram(X, method='merge_tree', approximate=True)
+    merge_dend.save(str(tmpdir.join('merge')))
+    loaded = selection.Dendrogram.load(str(tmpdir.join('merge')), mmap=False)
+
+    assert loaded.adj is None
+    assert dict(loaded.graphs[50]) == dict(merge_dend.graphs[50])
+    assert loaded.transform(X, 200).shape[1] == 200
+
+    # Columns added to a loaded Dendrogram are paired as in the original
+    X_old, X_new = X.iloc[:, :250], X.iloc[:, 250:]
+    approx_dend = selection.Dendrogram(X_old, approximate=True, approx_thresh=.2,
+                                       max_threshes=50)
+    approx_dend.save(str(tmpdir.join('approx')))
+    loaded = selection.Dendrogram.load(str(tmpdir.join('approx')), mmap=False)
+    approx_dend.add_columns(X_new, X_old)
+    loaded.add_columns(X_new, X_old)
+    assert loaded._edge_weights.max() <= .2
+    assert np.array_equal(loaded.edges.edges, approx_dend.edges.edges)
+
+    def spearman(a, b):
+        return 1 - abs(a.corr(b, method='spearman'))
+    custom_dend = selection.Dendrogram(X_old.iloc[:, :20], spearman, max_threshes=10)
+    custom_dend.save(str(tmpdir.join('custom')))
+    loaded = selection.Dendrogram.load(str(tmpdir.join('custom')))
+    with pytest.raises(AssertionError):
+        loaded.add_columns(X_new.iloc[:, :5], X_old.iloc[:, :20])
+
+
+def test_dend_add_columns(Xy):
+    X, y = Xy
+    full_dend = selection.Dendrogram(X, method='merge_tree')
+    merge_dend = selection.Dendrogram(X.iloc[:, :250], method='merge_tree')
+    merge_dend.add_columns(X.iloc[:, 250:], X.iloc[:, :250])
+
+    assert merge_dend.columns == full_dend.columns
+    assert merge_dend.adj.shape == full_dend.adj.shape
+    assert np.allclose(merge_dend.threshlist[1:], full_dend.threshlist[1:])
+    assert np.array_equal(merge_dend.graphs.n_components, full_dend.graphs.n_components)
+
+    thresh_dend = selection.Dendrogram(X.iloc[:, :250], max_threshes=50)
+    thresh_dend.add_columns(X.iloc[:, 250:], X.iloc[:, :250])
+    edges, weights = selection._edge_index(full_dend.adj)
+    stops = np.searchsorted(weights, thresh_dend.threshlist, side='right')
+    labels, _ = selection._merge_components(X.shape[1], edges, stops)
+
+    assert np.array_equal(thresh_dend.graphs.labels, labels)
+    assert len(thresh_dend.edges[-1]) == stops[-1]
+
+    # The thresholds of requested sizes are found again
+    size_dend = selection.Dendrogram(X.iloc[:, :250], sizes=[200, 100, 60], n_jobs=2)
+    size_dend.add_columns(X.iloc[:, 250:], X.iloc[:, :250])
+    full_size_dend = selection.Dendrogram(X, sizes=[200, 100, 60])
+    assert list(size_dend.graphs.n_components) == list(full_size_dend.graphs.n_components)
+    assert np.allclose(size_dend.threshlist, full_size_dend.threshlist)